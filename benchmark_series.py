@@ -0,0 +1,41 @@
+from functools import lru_cache
+import pandas as pd
+import numpy as np
+import instrumentation
+
+# Benchmark series (03_returns/benchmark/*.csv) loaded once into sorted arrays.
+# Windows are found with binary search and mean rates come from prefix sums, so every query is O(log n) without any I/O.
+# All queries accept scalars or arrays of entry/exit times (unix milliseconds).
+class BenchmarkSeries:
+    def __init__(self, df_benchmark):
+        df_benchmark = df_benchmark.sort_values(by = ["time"], kind = "stable")
+        self.time = df_benchmark["time"].to_numpy(dtype = "float64") # Unix seconds
+        self.open = df_benchmark["open"].to_numpy(dtype = "float64")
+        self.close = df_benchmark["close"].to_numpy(dtype = "float64")
+        self.open_sum = np.concatenate([[0.0], np.cumsum(self.open)]) # open_sum[i] = sum of the first i opens
+
+    def get_window(self, first_entry_time, last_exit_time): # Get rows [first, last) between first entry and last exit
+        first = np.searchsorted(self.time, np.asarray(first_entry_time) / 1000, side = "left")
+        last = np.searchsorted(self.time, np.asarray(last_exit_time) / 1000, side = "right")
+        return first, np.maximum(first, last)
+
+    def get_return(self, first_entry_time, last_exit_time): # Get benchmark return for specified timeframe. Use last close time and first open time (0 if there is no data).
+        first, last = self.get_window(first_entry_time, last_exit_time)
+        filled = last > first
+        if self.time.shape[0] == 0:
+            return np.zeros(np.shape(first))[()]
+        return np.where(filled, self.close[np.where(filled, last - 1, 0)] / self.open[np.where(filled, first, 0)], 0)[()]
+
+    def get_percentage_return(self, first_entry_time, last_exit_time): # Get benchmark return of a benchmark that specifies percentages instead of prices (like US treasury bill)
+        # Buy every day since open time with 1/30th the size (to average out over the whole period). End 30 days before last close time.
+        first, last = self.get_window(first_entry_time, last_exit_time)
+        rows = last - first
+        count = np.where(rows >= 30, rows - 30, 2 * rows - 30) # Same rows as df[:rows - 30], which counts from the end if rows < 30
+        last = first + np.maximum(count, 0)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            mean = np.where(count > 0, (self.open_sum[last] - self.open_sum[first]) / count, np.nan)
+        return (mean * 0.01 + 1)[()]
+
+@lru_cache(maxsize = None)
+def get_benchmark(file): # Get benchmark series of a file. Every file is read once per process.
+    return BenchmarkSeries(instrumentation.read_csv(file, encoding = "utf-8"))
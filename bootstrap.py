@@ -0,0 +1,98 @@
+from argparse import ArgumentParser
+from zlib import crc32
+import numpy as np
+import os
+import panel
+
+# Vectorized (block) bootstrap of trade returns for many groups (symbol, prepare, holding, sigma) at once.
+# Every bootstrap sample redraws blocks of block_size consecutive trades (circular) inside its group from a seeded generator, so
+# autocorrelated returns keep their structure. Index matrices of all groups of a chunk are drawn at once and the compounded return,
+# standard deviation and Sharpe ratio are reduced per group with segment sums. Chunks keep samples x trades below max_elements.
+# --bootstrap-samples N sets the number of samples, 0 skips the bootstrap (the columns stay NaN).
+SAMPLES = 1000
+BLOCK_SIZE = 5
+SEED = 0
+CONFIDENCE = 0.95
+
+def get_samples(): # Get number of bootstrap samples from --bootstrap-samples (default from the environment, set by the parent process, so workers use the same one)
+    parser = ArgumentParser()
+    parser.add_argument("--bootstrap-samples", type = int, default = int(os.environ.get("BA_BOOTSTRAP_SAMPLES", SAMPLES)), help = "bootstrap samples per group (0 = skip)")
+    samples = max(parser.parse_known_args()[0].bootstrap_samples, 0)
+    os.environ["BA_BOOTSTRAP_SAMPLES"] = str(samples)
+    return samples
+
+def get_generator(*keys, seed = SEED): # Get a generator that only depends on the seed and the keys (for example strategy and symbol), not on the order or the worker that runs it
+    return np.random.default_rng([seed] + [crc32(str(key).encode("utf-8")) for key in keys])
+
+def get_chunks(sizes, samples, max_elements): # Get [first, last) ranges of groups whose trades fit into one chunk
+    chunks = []
+    first = 0
+    elements = 0
+    for group, size in enumerate(sizes):
+        if group > first and elements + size * samples > max_elements:
+            chunks.append((first, group))
+            first, elements = group, 0
+        elements = elements + size * samples
+    if first < len(sizes):
+        chunks.append((first, len(sizes)))
+    return chunks
+
+def draw_indices(generator, sizes, samples, block_size): # Get index matrix (samples x sum of sizes) into the concatenated trades of the groups
+    sizes = np.asarray(sizes, dtype = "int64")
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    group = np.repeat(np.arange(sizes.shape[0]), sizes) # Group of every position
+    position = np.arange(sizes.sum()) - offsets[group] # Position inside the group
+
+    blocks = -(-sizes // block_size) # Blocks per group
+    block = np.concatenate([[0], np.cumsum(blocks)[:-1]])[group] + position // block_size # Block of every position
+    starts = (generator.random((samples, blocks.sum())) * np.repeat(sizes, blocks)).astype("int64") # Random first trade of every block
+    return offsets[group] + (starts[:, block] + position % block_size) % sizes[group]
+
+def bootstrap_groups(returns, sizes, benchmark_returns, samples = SAMPLES, block_size = BLOCK_SIZE, generator = None, max_elements = 5000000):
+    # Get bootstrap distributions (samples x groups) of compounded return and Sharpe ratio. returns holds the trades of all groups one after another, sizes the trades per group.
+    generator = get_generator() if generator is None else generator
+    returns = np.asarray(returns, dtype = "float64")
+    sizes = np.asarray(sizes, dtype = "int64")
+    benchmark_returns = np.asarray(benchmark_returns, dtype = "float64")
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+    compounded = np.full((samples, sizes.shape[0]), np.nan)
+    sharpe = np.full((samples, sizes.shape[0]), np.nan)
+    for first, last in get_chunks(sizes.tolist(), samples, max_elements):
+        chunk_sizes = sizes[first:last]
+        chunk_returns = returns[offsets[first]:offsets[last]]
+        starts = np.concatenate([[0], np.cumsum(chunk_sizes)[:-1]])
+        sample_chunk = max(1, max_elements // max(int(chunk_sizes.sum()), 1)) # A single large group is split along the samples
+
+        for sample_first in range(0, samples, sample_chunk):
+            sample_last = min(sample_first + sample_chunk, samples)
+            values = chunk_returns[draw_indices(generator, chunk_sizes, sample_last - sample_first, block_size)]
+
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                growth = np.exp(np.add.reduceat(np.log1p(values), starts, axis = 1)) # Product of (1 + return), liquidated trades (-1) give 0
+                mean = np.add.reduceat(values, starts, axis = 1) / chunk_sizes
+                variance = np.maximum(np.add.reduceat(values ** 2, starts, axis = 1) / chunk_sizes - mean ** 2, 0)
+                compounded[sample_first:sample_last, first:last] = growth - 1
+                sharpe[sample_first:sample_last, first:last] = (growth - 1 - benchmark_returns[first:last]) / np.sqrt(variance)
+    return compounded, sharpe
+
+def summarize(distribution, confidence = CONFIDENCE): # Get (lower bound, upper bound, p-value) of every group (column). The p-value is the bootstrap probability of a value <= 0.
+    if distribution.shape[1] == 0: # No groups
+        return np.empty(0), np.empty(0), np.empty(0)
+    lower, upper = panel.cross_sectional_quantile(distribution.T, [(1 - confidence) / 2, (1 + confidence) / 2]) # Groups without any valid sample stay NaN
+    with np.errstate(invalid = "ignore"):
+        p_value = (np.sum(distribution <= 0, axis = 0) + 1) / (np.sum(~np.isnan(distribution), axis = 0) + 1)
+    return lower, upper, p_value
+
+def get_significance(returns, sizes, benchmark_returns, sharpe_name = "sharpe", samples = None, block_size = BLOCK_SIZE, generator = None): # Get confidence intervals and p-values of return and Sharpe ratio for every group as dict of columns (NaN with 0 samples)
+    samples = get_samples() if samples is None else samples
+    columns = {}
+    if samples == 0:
+        for name in ["return", sharpe_name]:
+            columns[f"{name}_ci_low"], columns[f"{name}_ci_high"], columns[f"{name}_p_value"] = (np.full(len(sizes), np.nan) for _ in range(3))
+        return columns
+
+    compounded, sharpe = bootstrap_groups(returns, sizes, benchmark_returns, samples, block_size, generator)
+    for name, distribution in [("return", compounded), (sharpe_name, sharpe)]:
+        columns[f"{name}_ci_low"], columns[f"{name}_ci_high"], columns[f"{name}_p_value"] = summarize(distribution)
+    return columns
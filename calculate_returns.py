@@ -1,101 +1,162 @@
 from glob import glob
+from heapq import merge
 import pandas as pd
+import numpy as np
 from os.path import basename, isfile
+from benchmark_series import get_benchmark
+import trade_store
+import parallel
+import instrumentation
+import bootstrap
+import results_store
+import schemas
+
+SIGNIFICANCE_COLUMNS = [ # Bootstrap confidence intervals and p-values (probability of a value <= 0), see bootstrap.py
+    "return_ci_low"
+    , "return_ci_high"
+    , "return_p_value"
+    , "total_crypto_sharpe_ci_low"
+    , "total_crypto_sharpe_ci_high"
+    , "total_crypto_sharpe_p_value"
+]
+RETURNS_COLUMNS = [ # Columns of returns.csv
+    "symbol"
+    , "strategy"
+    , "prepare_interval"
+    , "holding_interval"
+    , "first_entry_time"
+    , "last_exit_time"
+    , "max_drawdown"
+    , "return"
+    , "standard_deviation"
+    , "us_30d_tbill_sharpe"
+    , "sp500_sharpe"
+    , "total_crypto_sharpe"
+] + SIGNIFICANCE_COLUMNS
 
-def get_percentage_benchmark_return(file, first_entry_time, last_exit_time): # Get benchmark return for specified timeframe of a benchmark that specifies percentages instead of prices (like US treasury bill)
-    df_benchmark = pd.read_csv(file, encoding = "utf-8")
-    
-    # Get relevant timeframe. Buy every day since open time with 1/30th the size (to average out over the whole period). End 30 days before last close time.
-    df_benchmark = df_benchmark[(df_benchmark["time"] >= first_entry_time / 1000) & (df_benchmark["time"] <= last_exit_time / 1000)]
-    df_benchmark = df_benchmark[:df_benchmark.shape[0] - 30]
 
-    return df_benchmark["open"].mean() * 0.01 + 1
+def get_percentage_benchmark_return(file, first_entry_time, last_exit_time): # Get benchmark return for specified timeframe of a benchmark that specifies percentages instead of prices (like US treasury bill)
+    return get_benchmark(file).get_percentage_return(first_entry_time, last_exit_time) # Benchmark is loaded once and queried with binary search
 
 
 def get_benchmark_return(file, first_entry_time, last_exit_time): # Get benchmark return for specified timeframe
-    df_benchmark = pd.read_csv(file, encoding = "utf-8")
-
-    # Get relevant timeframe. Use last close time and first open time
-    df_benchmark = df_benchmark[(df_benchmark["time"] >= first_entry_time / 1000) & (df_benchmark["time"] <= last_exit_time / 1000)]
-
-    try:
-        return df_benchmark["close"].iloc[df_benchmark.shape[0] - 1] / df_benchmark["open"].iloc[0]
-    except:
-        return 0
-
-
-def get_single_returns(strategy): # Calculate single returns (for each symbol and period)
-    files = glob(f"02_strategy/{strategy}/*.csv")
-    returns = []
-
-    for file in files: # Read all files
-        print(file)
-        
-        df_trades = pd.read_csv(file, encoding = "utf-8")
-        if df_trades.shape[0] == 0:
-            continue
-        
-        file_name = basename(file)
-
-        symbol = file_name[:file_name.find("_")]
-        prepare_interval = file_name[file_name.find("_") + 1:file_name.rfind("_")]
-        holding_interval = file_name[file_name.rfind("_") + 1:-4]
-        max_drawdown = df_trades["max_drawdown"].min()
-        cumulated_return = (df_trades["return"] + 1).prod() - 1
-
-        standard_deviation = df_trades["return"].std(ddof = 0)
-        if standard_deviation == 0:
-            continue
-
-        first_entry_time = df_trades["entry_time"].iloc[0]
-        last_exit_time = df_trades["exit_time"].iloc[df_trades.shape[0] - 1]
+    return get_benchmark(file).get_return(first_entry_time, last_exit_time) # Benchmark is loaded once and queried with binary search
+
+
+def get_partition_returns(strategy, symbol): # Calculate returns of all groups (prepare interval, holding interval, sigma) of one symbol in one grouped pass
+    with instrumentation.stage("returns", f"{strategy}/{symbol}"):
+        print(strategy, symbol)
+
+        df_trades = trade_store.load_trades(strategy, symbol, columns = trade_store.KEYS + ["entry_time", "exit_time", "max_drawdown", "return"])
+        df_trades["growth"] = df_trades["return"] + 1
+        grouped = df_trades.groupby(trade_store.KEYS, sort = False, dropna = False)
+
+        df_returns = grouped.agg(
+            first_entry_time = ("entry_time", "first")
+            , last_exit_time = ("exit_time", "last")
+            , max_drawdown = ("max_drawdown", "min")
+            , growth = ("growth", "prod")
+        ).reset_index()
+        df_returns["return"] = df_returns["growth"] - 1
+        df_returns["standard_deviation"] = grouped["return"].std(ddof = 0).to_numpy()
+        evaluated = (df_returns["standard_deviation"] != 0).to_numpy()
+        df_returns = df_returns[evaluated]
+        if df_returns.shape[0] == 0: # Empty partition (for example a newly listed symbol) or only groups without variance
+            return pd.DataFrame(columns = RETURNS_COLUMNS)
+
+        # Trade returns of the evaluated groups one group after another (for the bootstrap)
+        group = grouped.ngroup().to_numpy()
+        order = np.argsort(group, kind = "stable")
+        order = order[evaluated[group[order]]]
+        sizes = np.bincount(group, minlength = evaluated.shape[0])[evaluated]
+
+        first_entry_time = df_returns["first_entry_time"].to_numpy()
+        last_exit_time = df_returns["last_exit_time"].to_numpy()
         us_30d_tbill_return = get_percentage_benchmark_return("03_returns/benchmark/US_30D_TBILL_D.csv", first_entry_time, last_exit_time)
-        us_30d_tbill_sharpe = (cumulated_return - us_30d_tbill_return) / standard_deviation
+        df_returns["us_30d_tbill_sharpe"] = (df_returns["return"] - us_30d_tbill_return) / df_returns["standard_deviation"]
         sp500_return = get_benchmark_return("03_returns/benchmark/SP500_D.csv", first_entry_time, last_exit_time)
-        sp500_sharpe = (cumulated_return - sp500_return) / standard_deviation
+        df_returns["sp500_sharpe"] = (df_returns["return"] - sp500_return) / df_returns["standard_deviation"]
         total_crypto_return = get_benchmark_return("03_returns/benchmark/CRYPTOMARKETCAP_D.csv", first_entry_time, last_exit_time)
-        total_crypto_sharpe = (cumulated_return - total_crypto_return) / standard_deviation
-
-        returns.append([
-            symbol
-            , strategy
-            , prepare_interval
-            , holding_interval
-            , first_entry_time
-            , last_exit_time
-            , max_drawdown
-            , cumulated_return
-            , standard_deviation
-            , us_30d_tbill_sharpe
-            , sp500_sharpe
-            , total_crypto_sharpe
-        ])
+        df_returns["total_crypto_sharpe"] = (df_returns["return"] - total_crypto_return) / df_returns["standard_deviation"]
 
-    df_returns = pd.DataFrame(returns, columns = [
-        "symbol"
-        , "strategy"
-        , "prepare_interval"
-        , "holding_interval"
-        , "first_entry_time"
-        , "last_exit_time"
-        , "max_drawdown"
-        , "return"
-        , "standard_deviation"
-        , "us_30d_tbill_sharpe"
-        , "sp500_sharpe"
-        , "total_crypto_sharpe"
-    ])
+        significance = bootstrap.get_significance(df_trades["return"].to_numpy()[order], sizes, total_crypto_return, "total_crypto_sharpe", generator = bootstrap.get_generator(strategy, symbol))
+        for column, values in significance.items():
+            df_returns[column] = values
+
+        df_returns["symbol"] = symbol
+        df_returns["strategy"] = [trade_store.get_strategy_name(strategy, sigma) for sigma in df_returns["sigma"]]
+        return df_returns[RETURNS_COLUMNS]
+
+
+def get_single_returns(strategy, workers = 1): # Calculate single returns (for each symbol and period)
+    partitions = trade_store.list_trades(strategy)
+    returns = parallel.run_tasks(get_partition_returns, partitions, workers) # Frames keep the order of partitions for any number of workers
+    if len(returns) == 0:
+        print(f"[!] No trades of {strategy}.")
+        return
+    df_returns = pd.concat(returns, ignore_index = True)
 
     filename = "03_returns/returns.csv"
-    if not isfile(filename):
-        df_returns.to_csv(filename, index = False)
+    if isfile(filename): # Replace earlier rows of the strategy, so reruns do not duplicate rows
+        df_other = instrumentation.read_csv(filename, encoding = "utf-8")
+        df_other = df_other[df_other["strategy"].str.split("/").str[0] != strategy]
+        instrumentation.write_csv(pd.concat([df_other, df_returns], ignore_index = True), filename, index = False)
     else:
-        df_returns.to_csv(filename, mode = "a", header = False, index = False)
+        instrumentation.write_csv(df_returns, filename, index = False)
+    results_store.save_returns(df_returns)
     
     print(df_returns.sort_values("total_crypto_sharpe"))
 
 
-def create_portfolio(strategy): # Create portfolios for strategy
+def iterate_trades(strategy, symbol, prepare_interval, holding_interval, chunk_size = 1024, sigma = None): # Get (entry_time, exit_time, return, max_drawdown) of one group in entry_time order (sigma None for strategies without sigma). Trades are read from the memory-mapped partition in chunks.
+    first, last = trade_store.read_groups(strategy, symbol).get((prepare_interval, holding_interval, sigma), (0, 0)) # Only the block of one sigma is ordered by entry_time
+    data = trade_store.read_trades(strategy, symbol, ["entry_time", "exit_time", "return", "max_drawdown"])
+
+    for start in range(first, last, chunk_size):
+        end = min(start + chunk_size, last)
+        columns = [data[column][start:end] for column in ["entry_time", "exit_time", "return", "max_drawdown"]]
+        instrumentation.count_read(*columns)
+        yield from zip(*[column.tolist() for column in columns])
+
+
+def create_interval_portfolio(strategy, prepare_interval, holding_interval, buffer_size = 65536): # Create portfolio of one pair of prepare and holding interval
+    with instrumentation.stage("portfolio", f"{strategy}/{prepare_interval}_{holding_interval}"):
+        # Trades of every symbol are already ordered by entry_time, so they are merged as streams and aggregated per entry_time on the fly (min exit_time, mean return, min max_drawdown).
+        # Only a buffer of portfolio rows is kept in memory.
+        print(prepare_interval, holding_interval)
+        path = f"03_returns/portfolio/{strategy}/{prepare_interval}_{holding_interval}.csv" # Every pair has its own file, so workers never write the same file
+        partitions = trade_store.list_trades(strategy)
+        chunk_size = max(256, buffer_size // max(len(partitions), 1)) # All streams are live at once, so together they hold about buffer_size trades as Python objects
+        trades = merge(*[iterate_trades(strategy, symbol, prepare_interval, holding_interval, chunk_size) for _, symbol in partitions])
+
+        rows = []
+        header = True
+        entry_time = None
+        for trade_entry_time, exit_time, trade_return, max_drawdown in trades:
+            if trade_entry_time != entry_time:
+                if entry_time is not None:
+                    rows.append([entry_time, portfolio_exit_time, return_sum / count, portfolio_max_drawdown])
+                entry_time, portfolio_exit_time, return_sum, count, portfolio_max_drawdown = trade_entry_time, exit_time, 0.0, 0, max_drawdown
+            portfolio_exit_time = min(portfolio_exit_time, exit_time)
+            return_sum = return_sum + trade_return
+            count = count + 1
+            portfolio_max_drawdown = min(portfolio_max_drawdown, max_drawdown)
+
+            if len(rows) == buffer_size:
+                write_portfolio_rows(rows, path, header)
+                rows, header = [], False
+
+        if entry_time is not None:
+            rows.append([entry_time, portfolio_exit_time, return_sum / count, portfolio_max_drawdown])
+        write_portfolio_rows(rows, path, header)
+
+
+def write_portfolio_rows(rows, path, header): # Write buffered portfolio rows (header = True starts a new file)
+    df_portfolio = schemas.apply_schema(pd.DataFrame(rows, columns = list(schemas.PORTFOLIO)), schemas.PORTFOLIO)
+    instrumentation.write_csv(df_portfolio, path, mode = "w" if header else "a", header = header, index = False)
+
+
+def create_portfolio(strategy, workers = 1): # Create portfolios for strategy
     intervals = [
         5
         , 15
@@ -108,73 +169,52 @@ def create_portfolio(strategy): # Create portfolios for strategy
         , 1440
     ]
 
-    for prepare_interval in intervals:
-        for holding_interval in intervals:
-            print(prepare_interval, holding_interval)
-            files = glob(f"02_strategy/{strategy}/*_{prepare_interval}_{holding_interval}.csv")
-            df_trades = pd.DataFrame(columns = ["entry_time", "entry_price", "exit_time", "exit_price", "max_drawdown", "return", "side"])
-            df_portfolio = pd.DataFrame(columns = ["exit_time", "max_drawdown", "return"])
-
-            for file in files: # Read all files
-                df = pd.read_csv(file, encoding = "utf-8")
-                df = df.drop(columns = ["trade"])
-                df["side"] = df["side"].astype(bool)
-                df["entry_time"] = df["entry_time"].astype("int64")
-                df["strategy"] = strategy
-                df["prepare_interval"] = prepare_interval
-                df["holding_interval"] = holding_interval
-                if df_trades.shape[0] == 0:
-                    df_trades = df
-                else:
-                    df_trades = pd.concat([df_trades, df])
-            
-            df_trades = df_trades.sort_values(by = ["entry_time"])
-            df_portfolio = df_trades.groupby(by = ["entry_time"]).agg({"exit_time": "min", "return": "mean", "max_drawdown": "min"})
-
-            df_portfolio.to_csv(f"03_returns/portfolio/{strategy}/{prepare_interval}_{holding_interval}.csv", index = True)
-
-
-def get_portfolio_returns(strategy): # Calculate portfolio returns (if all trades at the same time were to be equally weighted)
-    create_portfolio(strategy)
-
-    files = glob(f"03_returns/portfolio/{strategy}/*.csv")
-    returns = []
-
-    for file in files: # Read all files
-        print(file)
-        df_trades = pd.read_csv(file, encoding = "utf-8")
-        file_name = basename(file)
-
-        prepare_interval = file_name[:file_name.rfind("_")]
-        holding_interval = file_name[file_name.rfind("_") + 1:-4]
-        max_drawdown = df_trades["max_drawdown"].min()
-        cumulated_return = (df_trades["return"] + 1).prod() - 1
-
-        standard_deviation = df_trades["return"].std(ddof = 0)
-        if df_trades.shape[0] == 0 or standard_deviation == 0:
-            continue
-        first_entry_time = df_trades["entry_time"].iloc[0]
-        last_exit_time = df_trades["exit_time"].iloc[df_trades.shape[0] - 1]
-        us_30d_tbill_return = get_percentage_benchmark_return("03_returns/benchmark/US_30D_TBILL_D.csv", first_entry_time, last_exit_time)
-        us_30d_tbill_sharpe = (cumulated_return - us_30d_tbill_return) / standard_deviation
-        sp500_return = get_benchmark_return("03_returns/benchmark/SP500_D.csv", first_entry_time, last_exit_time)
-        sp500_sharpe = (cumulated_return - sp500_return) / standard_deviation
-        total_crypto_return = get_benchmark_return("03_returns/benchmark/CRYPTOMARKETCAP_D.csv", first_entry_time, last_exit_time)
-        total_crypto_sharpe = (cumulated_return - total_crypto_return) / standard_deviation
-
-        returns.append([
-            strategy
-            , prepare_interval
-            , holding_interval
-            , first_entry_time
-            , last_exit_time
-            , max_drawdown
-            , cumulated_return
-            , standard_deviation
-            , us_30d_tbill_sharpe
-            , sp500_sharpe
-            , total_crypto_sharpe
-        ])
+    parallel.run_tasks(create_interval_portfolio, [(strategy, prepare_interval, holding_interval) for prepare_interval in intervals for holding_interval in intervals], workers)
+
+
+def get_portfolio_file_returns(file, strategy): # Calculate returns of one portfolio file. Returns None if there is nothing to evaluate.
+    print(file)
+    df_trades = schemas.read_csv(file, schemas.PORTFOLIO)
+    file_name = basename(file)
+
+    prepare_interval = file_name[:file_name.rfind("_")]
+    holding_interval = file_name[file_name.rfind("_") + 1:-4]
+    max_drawdown = df_trades["max_drawdown"].min()
+    cumulated_return = (df_trades["return"] + 1).prod() - 1
+
+    standard_deviation = df_trades["return"].std(ddof = 0)
+    if df_trades.shape[0] == 0 or standard_deviation == 0:
+        return None
+    first_entry_time = df_trades["entry_time"].iloc[0]
+    last_exit_time = df_trades["exit_time"].iloc[df_trades.shape[0] - 1]
+    us_30d_tbill_return = get_percentage_benchmark_return("03_returns/benchmark/US_30D_TBILL_D.csv", first_entry_time, last_exit_time)
+    us_30d_tbill_sharpe = (cumulated_return - us_30d_tbill_return) / standard_deviation
+    sp500_return = get_benchmark_return("03_returns/benchmark/SP500_D.csv", first_entry_time, last_exit_time)
+    sp500_sharpe = (cumulated_return - sp500_return) / standard_deviation
+    total_crypto_return = get_benchmark_return("03_returns/benchmark/CRYPTOMARKETCAP_D.csv", first_entry_time, last_exit_time)
+    total_crypto_sharpe = (cumulated_return - total_crypto_return) / standard_deviation
+    significance = bootstrap.get_significance(df_trades["return"].to_numpy(), [df_trades.shape[0]], [total_crypto_return], "total_crypto_sharpe", generator = bootstrap.get_generator(strategy, file_name))
+
+    return [
+        strategy
+        , prepare_interval
+        , holding_interval
+        , first_entry_time
+        , last_exit_time
+        , max_drawdown
+        , cumulated_return
+        , standard_deviation
+        , us_30d_tbill_sharpe
+        , sp500_sharpe
+        , total_crypto_sharpe
+    ] + [significance[column][0] for column in SIGNIFICANCE_COLUMNS]
+
+
+def get_portfolio_returns(strategy, workers = 1): # Calculate portfolio returns (if all trades at the same time were to be equally weighted)
+    create_portfolio(strategy, workers)
+
+    files = sorted(glob(f"03_returns/portfolio/{strategy}/*.csv"))
+    returns = [row for row in parallel.run_tasks(get_portfolio_file_returns, [(file, strategy) for file in files], workers) if row is not None]
 
     df_returns = pd.DataFrame(returns, columns = [
         "strategy"
@@ -188,27 +228,29 @@ def get_portfolio_returns(strategy): # Calculate portfolio returns (if all trade
         , "us_30d_tbill_sharpe"
         , "sp500_sharpe"
         , "total_crypto_sharpe"
-    ])
+    ] + SIGNIFICANCE_COLUMNS)
 
-    df_returns.to_csv(f"03_returns/portfolio_returns.csv", index = False)
+    instrumentation.write_csv(df_returns, f"03_returns/portfolio_returns.csv", index = False)
+    results_store.save_portfolio_returns(df_returns)
     print(df_returns.sort_values("total_crypto_sharpe"))
 
 
-def main():
+def main(workers = 1):
     strategies = [
         "ts"
-        , "sd/1.0"
-        , "sd/1.5"
-        , "sd/2.0"
-        , "sd/2.5"
-        , "sd/3.0"
+        , "sd" # All sigmas at once
     ]
 
-    for strategy in strategies:
-        get_single_returns(strategy)
+    instrumentation.start_run("returns")
+    schemas.configure()
+    bootstrap.get_samples()
+    with instrumentation.stage("returns"):
+        for strategy in strategies:
+            get_single_returns(strategy, workers)
     
-    get_portfolio_returns("ts")
+    with instrumentation.stage("portfolio"):
+        get_portfolio_returns("ts", workers)
     
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(workers = parallel.get_workers())
\ No newline at end of file
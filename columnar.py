@@ -0,0 +1,51 @@
+import numpy as np
+import instrumentation
+import os
+
+# Columnar partitions shared by the kline store and the trade store. A partition is a directory with one raw binary file per column.
+# The schema is a dict of column name -> numpy dtype. The first column of the schema is written last and marks the last complete row.
+
+def get_column_path(partition, column): # Get file of one column inside a partition
+    return f"{partition}/{column}.bin"
+
+def exists(partition, schema): # Check if partition exists
+    return os.path.exists(get_column_path(partition, next(iter(schema))))
+
+def get_rows(partition, schema): # Get number of complete rows. A crash while appending can leave some columns longer than others, so only count rows that exist in every column.
+    rows = []
+    for column, dtype in schema.items():
+        path = get_column_path(partition, column)
+        rows.append(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0)
+    return min(rows)
+
+def read_partition(partition, schema, columns = None): # Get memory-mapped columns of a partition (zero-copy)
+    columns = list(schema) if columns is None else columns
+    rows = get_rows(partition, schema)
+
+    data = {}
+    for column in columns:
+        if rows == 0: # Empty files cannot be memory-mapped
+            data[column] = np.empty(0, dtype = schema[column])
+        else:
+            data[column] = np.memmap(get_column_path(partition, column), dtype = schema[column], mode = "r", shape = (rows,))
+        instrumentation.count("bytes_mapped", rows * schema[column].itemsize) # Pages are only read when they are used, callers count the slices they copy (instrumentation.count_read)
+    return data
+
+def truncate_partition(partition, schema, rows): # Keep only the first rows of a partition
+    for column, dtype in schema.items():
+        path = get_column_path(partition, column)
+        if os.path.exists(path) and os.path.getsize(path) > rows * dtype.itemsize:
+            os.truncate(path, rows * dtype.itemsize)
+
+def append_partition(partition, schema, data): # Append rows (dict or dataframe of columns) to a partition
+    os.makedirs(partition, exist_ok = True)
+    rows = get_rows(partition, schema)
+    truncate_partition(partition, schema, rows) # Cut off rows of an interrupted append before writing new ones
+
+    columns = list(schema)
+    for column in columns[1:] + columns[:1]:
+        with open(get_column_path(partition, column), "ab") as f:
+            instrumentation.count("bytes_written", f.write(np.ascontiguousarray(data[column], dtype = schema[column]).tobytes()))
+
+    instrumentation.count("rows_written", len(data[columns[0]]))
+    return rows + len(data[columns[0]])
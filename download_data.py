@@ -1,95 +1,90 @@
-from requests import request
-from time import time
+from fetch_engine import KlineClient
+from time import time, sleep
 import pandas as pd
-import os
+import kline_store
+import resample_engine
+import instrumentation
 
-def get_symbols(): # Get all active Bybit USDT perpetual trading pairs
-    response = request("GET", "https://api.bybit.com/v5/market/tickers?category=linear").json()
+def get_symbols(client): # Get all active Bybit USDT perpetual trading pairs
+    return client.get_symbols()
 
-    symbols = []
-    for symbol in response["result"]["list"]:
-        if symbol["symbol"][-4:] == "USDT": symbols.append(symbol["symbol"]) # Only append all perpetual contracts that use USDT as collateral (instead of USDC as collateral or regular derivatives)
-    
-    return symbols
+def save_pages(pages, symbol, interval, unix_now): # Append buffered pages to the kline store. Only completed candles newer than the stored ones are saved.
+    if len(pages) == 0:
+        return 0
+    interval_size = (interval * 60 * 1000)
+    last_start_time = kline_store.get_last_start_time(symbol, interval)
 
-def get_initial_data(symbols, interval): # Get historical data of all symbols for the smallest interval
-    unix_first = 1262304000 * 1000 # 2010-01-01 00:00 UTC
+    df = pd.DataFrame(columns = ["start_time", "open", "high", "low", "close", "volume", "turnover"], data = [kline for page in pages for kline in page]) # Build the frame once per checkpoint instead of once per page
+    df = df.astype(kline_store.COLUMNS).sort_values(by = ["start_time"]).drop_duplicates(subset = ["start_time"])
+    df = df[df["start_time"] + interval_size <= unix_now] # Delete current candle
+    if last_start_time is not None:
+        df = df[df["start_time"] > last_start_time]
+
+    kline_store.append_klines(df, symbol, interval)
+    return df.shape[0]
+
+def download_symbol(client, symbol, interval, unix_last, incremental = True): # Get historical data of one symbol. Incremental mode only fetches candles after the newest stored one.
+    with instrumentation.stage("download", symbol):
+        unix_first = 1262304000 * 1000 # 2010-01-01 00:00 UTC
+        interval_size = (interval * 60 * 1000) # Time between two candles
+        checkpoint_pages = 50 # Pages buffered before they are appended to the kline store. A crashed run resumes from the last checkpoint.
+
+        if not incremental:
+            kline_store.truncate_klines(symbol, interval, 0)
+        last_start_time = kline_store.get_last_start_time(symbol, interval)
+        unix_start = unix_first if last_start_time is None else last_start_time + interval_size # Continue after the newest stored candle or set first unix far in the past
+        if unix_start >= unix_last - interval_size: # Already up to date
+            return 0
+
+        print(f"GET: {symbol} @{interval}")
+        unix_now = int(time() * 1000)
+        pages = []
+        rows = 0
+        for kline in client.get_pages(symbol, interval, unix_start, unix_last):
+            pages.append(kline) # Buffer pages, so appending stays linear
+            if len(pages) == checkpoint_pages:
+                rows = rows + save_pages(pages, symbol, interval, unix_now)
+                pages = []
+
+        rows = rows + save_pages(pages, symbol, interval, unix_now)
+        print(f"   + {rows} rows saved. ({symbol})")
+        return rows
+
+def get_initial_data(client, symbols, interval, incremental = True): # Get historical data of all symbols for the smallest interval. Symbols are downloaded in parallel.
     unix_last = int(86400 * int(time() / 86400)) * 1000 # Get current date at 00:00:00 midnight in unix.
-    interval_size = (interval * 60 * 1000) # Time between two candles
-    rows_total = 0
+    with instrumentation.stage("download"):
+        rows = client.map_symbols(lambda symbol: download_symbol(client, symbol, interval, unix_last, incremental), symbols)
+    print(f"   > {sum(rows)} total rows.")
 
-    for symbol in symbols:
-        if not os.path.exists(f"{os.getcwd()}/01_raw/{symbol}_{interval}.csv"):
-            print(f"GET: {symbol} @{interval}")
-            unix_start = unix_first # Set first unix far in the past
-            df = pd.DataFrame(columns = ["start_time", "open", "high", "low", "close", "volume", "turnover"])
-            while unix_start < unix_last - interval_size:
-                if interval == 1440: interval = "D" # API only accepts "D" and not 1440
-                response = request("GET", f"https://api.bybit.com/v5/market/kline?category=linear&symbol={symbol}&interval={interval}&start={unix_start}").json()
-                
-                returnCode = response["retCode"]
-                if returnCode != 0: # Quit if returnCode is not 0 (OK)
-                    print(f"[!] {returnCode}: {response['retMsg']}")
-                    quit()
-                
-                kline = response["result"]["list"]
-                df = pd.concat([df, pd.DataFrame(columns=["start_time", "open", "high", "low", "close", "volume", "turnover"], data = kline)]) # Append all new data to old data
-                unix_start = int(kline[0][0]) + interval_size
-                
-            df = df.set_index("start_time").sort_index() # Sort data
-            df = df[:-1] # Delete last row (current candle)
-            df.to_csv(f"01_raw/{symbol}_{interval}.csv", encoding = "utf-8") # Save data as csv
-            rows = df.shape[0]
-            rows_total = rows_total + rows
-            print(f"   + {rows} rows saved.\n   > {rows_total} total rows.")
+def get_remaining_data(symbols, smallest_interval, incremental = True): # Get historical data of all symbols for the all the other intervals. All intervals are resampled in one pass.
+    with instrumentation.stage("resample"):
+        for symbol in symbols:
+            try:
+                print(f"GET: {symbol} @{resample_engine.INTERVALS}")
+                with instrumentation.stage("resample", symbol):
+                    resample_engine.update_resampled(symbol, smallest_interval, resample_engine.INTERVALS, incremental)
+            except Exception as e:
+                print(f"{symbol} could not be fetched. Probably sorted out beforehand. ({e})")
 
-def resample_data(df, symbol, interval): # Resample data of df with interval
-    df["index"] = df["start_time"].astype("datetime64[ms]")
-    df = df.set_index("index")
-    df_resampled = df.resample(f"{interval}min").agg(
-        {
-            "start_time": "first"
-            , "open": "first"
-            , "high": "max"
-            , "low": "min"
-            , "close": "last"
-            , "volume": "sum"
-            , "turnover": "sum"
-        }
-    )
-    df_resampled["start_time"] = df_resampled["start_time"].astype("int64")
-    df_resampled.to_csv(f"01_raw/{symbol}_{interval}.csv", encoding = "utf-8", index = False) # Save data as csv
-    return df_resampled
-    
-def get_remaining_data(symbols, smallest_interval): # Get historical data of all symbols for the all the other intervals
-    intervals = [
-        15
-        , 30
-        , 60
-        , 120
-        , 240
-        , 360
-        , 720
-        , 1440
-    ]
+def main(incremental = True, workers = 8, requests_per_second = 20):
+    smallest_interval = 5
+    client = KlineClient(workers = workers, requests_per_second = requests_per_second)
+    attempts = 10
+    instrumentation.start_run("download")
 
-    for symbol in symbols:
+    for attempt in range(attempts):
         try:
-            df = pd.read_csv(f"01_raw/{symbol}_{smallest_interval}.csv", encoding = "utf-8") # Read data of smallest interval
-            for interval in intervals:
-                print(f"GET: {symbol} @{interval}")
-                df = resample_data(df, symbol, interval)
-        except:
-            print(f"{symbol} could not be fetched. Probably sorted out beforehand.")
-
-def main():
-    try:
-        smallest_interval = 5
-        symbols = get_symbols()
-        get_initial_data(symbols, smallest_interval)
-        get_remaining_data(symbols, smallest_interval)
-    except:
-        os.system("download_data.py")
+            symbols = get_symbols(client)
+            get_initial_data(client, symbols, smallest_interval, incremental)
+            get_remaining_data(symbols, smallest_interval, incremental)
+            return
+        except Exception as e: # Resume from the last checkpoint instead of starting over
+            print(f"[!] Attempt {attempt + 1} failed: {e}")
+            if attempt == attempts - 1: # Callers (the pipeline, cron jobs) must see the failure instead of an exit code 0
+                print(f"[!] Download failed after {attempts} attempts.")
+                raise
+            incremental = True
+            sleep(min(2 ** attempt, 60))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlencode
+from requests import Session
+from requests.adapters import HTTPAdapter
+import json
+import os
+import instrumentation
+
+BASE_URL = "https://api.bybit.com"
+
+class RequestBudget: # Spread requests evenly, so all threads together stay below a number of requests per second
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.next_time = monotonic()
+        self.lock = Lock()
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(self.next_time, now) + self.interval
+        if wait_time > 0:
+            sleep(wait_time)
+
+class KlineClient: # Bybit client with pooled HTTP connections that pages many symbols in parallel
+    def __init__(self, base_url = BASE_URL, workers = 8, requests_per_second = 20, max_retries = 5, backoff = 1.0, record_directory = None):
+        self.base_url = base_url
+        self.workers = workers
+        self.budget = RequestBudget(requests_per_second)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.record_directory = record_directory
+
+        self.session = Session() # One session shared by all threads, so connections are reused
+        adapter = HTTPAdapter(pool_connections = workers, pool_maxsize = workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path, params): # Get result of one request. Back off and retry if the HTTP request fails or retCode is not 0 (OK).
+        for attempt in range(self.max_retries + 1):
+            self.budget.wait()
+            instrumentation.count("http_requests")
+            try:
+                http_response = self.session.get(f"{self.base_url}{path}", params = params, timeout = 30)
+                instrumentation.count("http_bytes", len(http_response.content))
+                response = http_response.json()
+            except Exception as e:
+                response = {"retCode": -1, "retMsg": str(e)}
+
+            if response["retCode"] == 0:
+                if self.record_directory is not None:
+                    record_response(self.record_directory, path, params, response)
+                return response["result"]
+
+            print(f"[!] {response['retCode']}: {response['retMsg']} ({path} {params})")
+            if attempt < self.max_retries:
+                instrumentation.count("http_retries")
+                sleep(self.backoff * 2 ** attempt)
+
+        raise RuntimeError(f"[!] {response['retCode']}: {response['retMsg']}")
+
+    def get_symbols(self): # Get all active Bybit USDT perpetual trading pairs
+        result = self.get("/v5/market/tickers", {"category": "linear"})
+        return [symbol["symbol"] for symbol in result["list"] if symbol["symbol"][-4:] == "USDT"] # Only append all perpetual contracts that use USDT as collateral (instead of USDC as collateral or regular derivatives)
+
+    def get_pages(self, symbol, interval, unix_start, unix_last): # Get pages of klines of one symbol in order, starting at unix_start
+        interval_size = (interval * 60 * 1000) # Time between two candles
+        api_interval = "D" if interval == 1440 else interval # API only accepts "D" and not 1440
+
+        while unix_start < unix_last - interval_size:
+            kline = self.get("/v5/market/kline", {"category": "linear", "symbol": symbol, "interval": api_interval, "start": unix_start})["list"]
+            if len(kline) == 0: # No newer candles
+                break
+            yield kline
+            unix_start = int(kline[0][0]) + interval_size
+
+    def map_symbols(self, function, symbols): # Run function for all symbols in parallel. Pages of one symbol are always fetched by the same thread and in order. Results keep the order of symbols.
+        if self.workers == 1:
+            return [function(symbol) for symbol in symbols]
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            return list(executor.map(function, symbols))
+
+def get_record_path(directory, path, params): # Get file of a recorded response
+    query = urlencode(sorted((key, str(value)) for key, value in params.items()))
+    return f"{directory}/{path.strip('/').replace('/', '_')}_{query.replace('&', '_').replace('=', '-')}.json"
+
+def record_response(directory, path, params, response): # Save response, so it can be replayed by replay_server.py
+    os.makedirs(directory, exist_ok = True)
+    with open(get_record_path(directory, path, params), "w", encoding = "utf-8") as f:
+        json.dump(response, f)
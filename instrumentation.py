@@ -0,0 +1,139 @@
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter, time
+import pandas as pd
+import cProfile
+import json
+import os
+
+try:
+    import resource # Peak RSS (Unix only)
+except ImportError:
+    resource = None
+
+# Run instrumentation (opt-in, scripts call start_run). Every finished stage (optionally of one partition like a symbol or an interval) is appended as one json line
+# to the run log: wall time, rows and bytes read/written (column slices copied out of the columnar stores and csv files, per second), bytes
+# memory-mapped, HTTP requests/retries and peak RSS.
+# Workers append to the same log, every line carries the run id. One stage can be profiled with cProfile (--profile STAGE).
+# > python strategy_standard_deviation.py --run-log logs/run.ndjson --profile sd
+# Counters are kept per thread as well, so a partition stage only counts the work of its own thread (download threads run in parallel).
+# Stage lines only count the work of their own process. With --workers the partition lines of the worker processes hold the counts.
+LOG_FILE = "logs/run.ndjson"
+COUNTERS = [
+    "rows_read"
+    , "rows_written"
+    , "bytes_read"
+    , "bytes_written"
+    , "bytes_mapped"
+    , "http_requests"
+    , "http_retries"
+    , "http_bytes"
+]
+
+totals = dict.fromkeys(COUNTERS, 0) # Counters of the process
+threads = local() # Counters of the current thread
+lock = Lock()
+profiling = False # Only one stage is profiled at a time (not nested stages of the same name or parallel threads)
+
+def start_run(name): # Start a run of a script. Settings go to environment variables, so worker processes write to the same log.
+    parser = ArgumentParser()
+    parser.add_argument("--run-log", default = os.environ.get("BA_RUN_LOG", LOG_FILE), help = "ndjson file the run is appended to")
+    parser.add_argument("--profile", default = os.environ.get("BA_PROFILE"), help = "stage to profile with cProfile")
+    arguments = parser.parse_known_args()[0]
+
+    os.environ["BA_RUN_ID"] = f"{name}-{int(time())}-{os.getpid()}"
+    os.environ["BA_RUN_LOG"] = arguments.run_log
+    if arguments.profile is not None:
+        os.environ["BA_PROFILE"] = arguments.profile
+    return os.environ["BA_RUN_ID"]
+
+def get_thread_counters():
+    if not hasattr(threads, "counters"):
+        threads.counters = dict.fromkeys(COUNTERS, 0)
+    return threads.counters
+
+def count(counter, value = 1): # Add value to a counter
+    with lock:
+        totals[counter] = totals[counter] + value
+    thread_counters = get_thread_counters()
+    thread_counters[counter] = thread_counters[counter] + value
+
+def count_read(*columns): # Count rows and bytes of column slices copied out of a store (all of the same length)
+    count("rows_read", len(columns[0]) if len(columns) > 0 else 0)
+    count("bytes_read", sum(column.nbytes for column in columns))
+
+def read_csv(file, **kwargs): # Read a csv file and count its rows and bytes
+    df = pd.read_csv(file, **kwargs)
+    count("rows_read", df.shape[0])
+    count("bytes_read", os.path.getsize(file))
+    return df
+
+def write_csv(df, file, mode = "w", **kwargs): # Write a frame to a csv file (mode "a" appends) and count its rows and bytes
+    with open(file, mode, encoding = "utf-8", newline = "") as f:
+        start = f.tell()
+        df.to_csv(f, **kwargs)
+        count("bytes_written", f.tell() - start)
+    count("rows_written", df.shape[0])
+
+def get_peak_rss(): # Get peak resident memory of this process in MB (None if unknown)
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # Kilobytes on Linux
+
+def write_record(record): # Append one json line to the run log. A single write per line keeps lines of parallel workers intact.
+    if os.environ.get("BA_RUN_ID") is None: # No run was started (for example functions called from a notebook)
+        return
+    path = os.environ.get("BA_RUN_LOG", LOG_FILE)
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "a", encoding = "utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+def start_profile(name): # Get a running profile if name is the profiled stage and no other stage is profiled
+    global profiling
+    with lock:
+        if os.environ.get("BA_PROFILE") != name or profiling:
+            return None
+        profiling = True
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+def stop_profile(profile):
+    global profiling
+    profile.disable()
+    with lock:
+        profiling = False
+
+@contextmanager
+def stage(name, partition = None): # Measure a stage. With a partition (symbol, interval, ...) only the counters of the current thread count.
+    counters = get_thread_counters() if partition is not None else totals
+    before = dict(counters)
+    profile = start_profile(name)
+    status = "ok"
+    start = perf_counter()
+    try:
+        yield
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        if profile is not None:
+            stop_profile(profile)
+        seconds = perf_counter() - start
+        record = {"run": os.environ.get("BA_RUN_ID"), "time": time(), "pid": os.getpid(), "stage": name, "partition": None if partition is None else str(partition), "status": status, "seconds": round(seconds, 6)}
+        for counter in COUNTERS:
+            record[counter] = counters[counter] - before[counter]
+        record["rows_per_second"] = (record["rows_read"] + record["rows_written"]) / seconds if seconds > 0 else None
+        record["peak_rss_mb"] = get_peak_rss()
+
+        if profile is not None:
+            profile_file = f"{os.path.dirname(os.environ.get('BA_RUN_LOG', LOG_FILE)) or '.'}/{name}" + ("" if partition is None else f"_{partition}".replace("/", "_")) + ".prof"
+            profile.dump_stats(profile_file)
+            record["profile"] = profile_file
+        write_record(record)
+
+def read_log(path = LOG_FILE, run = None): # Get records of the run log as Pandas Dataframe (only one run if run is set)
+    df_log = pd.read_json(path, lines = True)
+    return df_log[df_log["run"] == run] if run is not None else df_log
@@ -0,0 +1,93 @@
+from glob import glob
+import pandas as pd
+import numpy as np
+import columnar
+import schemas
+import instrumentation
+import os
+
+# Columnar kline store. Every symbol/interval is one partition directory (01_raw/{symbol}_{interval}/) with one raw binary file per column (see columnar.py).
+# Columns are opened memory-mapped, so reading a column does not parse or copy anything until the values are actually used.
+DIRECTORY = "01_raw"
+COLUMNS = {
+    "start_time": np.dtype("int64")
+    , "open": np.dtype("float64")
+    , "high": np.dtype("float64")
+    , "low": np.dtype("float64")
+    , "close": np.dtype("float64")
+    , "volume": np.dtype("float64")
+    , "turnover": np.dtype("float64")
+}
+
+def get_partition_path(symbol, interval, directory = DIRECTORY): # Get directory of one symbol/interval partition
+    return f"{directory}/{symbol}_{interval}"
+
+def exists(symbol, interval, directory = DIRECTORY): # Check if partition exists
+    return columnar.exists(get_partition_path(symbol, interval, directory), COLUMNS)
+
+def read_columns(symbol, interval, columns = None, directory = DIRECTORY): # Get memory-mapped columns of a partition (zero-copy)
+    return columnar.read_partition(get_partition_path(symbol, interval, directory), COLUMNS, columns)
+
+def load_klines(symbol, interval, columns = None, directory = DIRECTORY, precision = None): # Get klines of a partition as Pandas Dataframe with the dtypes of schemas.KLINES (prices in precision). Falls back to the old csv file if the partition was not converted yet.
+    columns = list(COLUMNS) if columns is None else columns
+    if not exists(symbol, interval, directory) and os.path.exists(f"{directory}/{symbol}_{interval}.csv"):
+        return schemas.read_csv(f"{directory}/{symbol}_{interval}.csv", schemas.KLINES, columns, precision)
+
+    dtypes = schemas.get_dtypes(schemas.KLINES, columns, precision)
+    data = read_columns(symbol, interval, columns, directory)
+    df = pd.DataFrame({column: np.asarray(data[column], dtype = dtypes[column]) for column in columns}, columns = columns)
+    instrumentation.count_read(*[df[column].to_numpy() for column in columns])
+    return df
+
+class KlineCache: # Keeps the klines loaded during a run, so every partition is loaded at most once. Clear it to bound memory.
+    def __init__(self, columns = None, directory = DIRECTORY, precision = None):
+        self.columns = columns
+        self.directory = directory
+        self.precision = precision
+        self.frames = {}
+
+    def get(self, symbol, interval): # Get klines of a partition. Callers must not modify the returned frame.
+        if (symbol, interval) not in self.frames:
+            self.frames[(symbol, interval)] = load_klines(symbol, interval, self.columns, self.directory, self.precision)
+        return self.frames[(symbol, interval)]
+
+    def clear(self, interval = None): # Drop all cached klines or only the ones of one interval
+        self.frames = {key: df for key, df in self.frames.items() if interval is not None and key[1] != interval}
+
+def get_last_start_time(symbol, interval, directory = DIRECTORY): # Get start time of the newest stored candle (None if there is none)
+    if not exists(symbol, interval, directory):
+        return None
+    start_time = read_columns(symbol, interval, ["start_time"], directory)["start_time"]
+    return int(start_time[-1]) if start_time.shape[0] > 0 else None
+
+def append_klines(df, symbol, interval, directory = DIRECTORY): # Append klines to a partition. Rows have to be newer than the stored ones.
+    return columnar.append_partition(get_partition_path(symbol, interval, directory), COLUMNS, df)
+
+def truncate_klines(symbol, interval, rows, directory = DIRECTORY): # Keep only the first rows of a partition
+    columnar.truncate_partition(get_partition_path(symbol, interval, directory), COLUMNS, rows)
+
+def save_klines(df, symbol, interval, directory = DIRECTORY): # Replace a partition with klines
+    truncate_klines(symbol, interval, 0, directory)
+    return append_klines(df, symbol, interval, directory)
+
+def list_klines(interval = None, directory = DIRECTORY): # Get all stored (symbol, interval) pairs, sorted by symbol and interval
+    partitions = []
+    for path in glob(f"{directory}/*_*/start_time.bin"):
+        name = os.path.basename(os.path.dirname(path))
+        symbol, partition_interval = name[:name.rfind("_")], int(name[name.rfind("_") + 1:])
+        if interval is None or partition_interval == interval:
+            partitions.append((symbol, partition_interval))
+    return sorted(partitions)
+
+def convert_csv_tree(directory = DIRECTORY): # One-shot conversion of all old 01_raw/{symbol}_{interval}.csv files into partitions
+    files = sorted(glob(f"{directory}/*_*.csv"))
+    for file in files:
+        name = os.path.basename(file)[:-4]
+        symbol, interval = name[:name.rfind("_")], int(name[name.rfind("_") + 1:])
+        df = pd.read_csv(file, encoding = "utf-8")
+        df = df.sort_values(by = ["start_time"]).drop_duplicates(subset = ["start_time"])
+        rows = save_klines(df, symbol, interval, directory)
+        print(f"CONVERT: {symbol} @{interval}\n   + {rows} rows saved.")
+
+if __name__ == "__main__":
+    convert_csv_tree()
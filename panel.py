@@ -0,0 +1,65 @@
+import pandas as pd
+import numpy as np
+
+# Dense time x symbol panel of a long kline frame for cross-sectional strategies.
+# Every column becomes a 2-D array (times x symbols). "mask" marks which cells exist and "rows" points back to the row of the long frame (-1 if the cell is empty).
+class Panel:
+    def __init__(self, times, symbols, values, mask, rows):
+        self.times = times
+        self.symbols = symbols
+        self.values = values
+        self.mask = mask
+        self.rows = rows
+
+    def get_size(self): # Get number of symbols per timestamp
+        return self.mask.sum(axis = 1)
+
+    def get_valid(self, column, minimum_size = 0): # Get values of column where the cell exists and the timestamp has at least minimum_size symbols, NaN otherwise
+        valid = self.mask & (self.get_size() >= minimum_size)[:, np.newaxis]
+        return np.where(valid, self.values[column], np.nan), valid
+
+    def select(self, df, selection): # Get rows of the long frame for all selected cells, ordered by time and symbol
+        return df.iloc[self.rows[selection]]
+
+def get_cell_bytes(itemsize, columns = 1): # Get estimated bytes of one cell of a panel: values, mask and rows, plus the copies of get_valid, cross_sectional_quantile and the selection masks
+    return columns * itemsize + 1 + 8 + (itemsize + 1) + (itemsize + 1) + 2
+
+def build_panel(df, columns, time_column = "start_time", symbol_column = "symbol"): # Turn a long frame into a panel
+    times, time_index = np.unique(df[time_column].to_numpy(), return_inverse = True)
+    if isinstance(df[symbol_column].dtype, pd.CategoricalDtype): # Unique codes instead of string comparisons, symbols are ordered like the categories
+        codes, symbol_index = np.unique(df[symbol_column].cat.codes.to_numpy(), return_inverse = True)
+        symbols = df[symbol_column].cat.categories.to_numpy()[codes]
+    else:
+        symbols, symbol_index = np.unique(df[symbol_column].to_numpy(), return_inverse = True)
+    shape = (times.shape[0], symbols.shape[0])
+
+    mask = np.zeros(shape, dtype = bool)
+    mask[time_index, symbol_index] = True
+    rows = np.full(shape, -1, dtype = "int64")
+    rows[time_index, symbol_index] = np.arange(df.shape[0])
+
+    values = {}
+    for column in columns:
+        values[column] = np.full(shape, np.nan, dtype = np.result_type(df[column].dtype, np.float32)) # float32 columns keep their precision
+        values[column][time_index, symbol_index] = df[column].to_numpy()
+    return Panel(times, symbols, values, mask, rows)
+
+def cross_sectional_quantile(values, q): # Get quantile(s) of every timestamp over all symbols (linear interpolation like pandas/numpy). Timestamps without values get NaN.
+    # One sort of the whole panel instead of one nanquantile call per timestamp. NaNs sort last, so the first count cells of a row are its values.
+    values = np.sort(values, axis = 1)
+    count = (~np.isnan(values)).sum(axis = 1)
+    rows = np.arange(values.shape[0])
+
+    quantiles = []
+    for quantile in np.atleast_1d(q):
+        position = quantile * np.maximum(count - 1, 0)
+        lower = np.floor(position).astype("int64")
+        upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+        weight = position - lower
+        low = values[rows, np.minimum(lower, values.shape[1] - 1)] if values.shape[1] > 0 else np.full(values.shape[0], np.nan)
+        high = values[rows, np.minimum(upper, values.shape[1] - 1)] if values.shape[1] > 0 else np.full(values.shape[0], np.nan)
+        with np.errstate(invalid = "ignore"):
+            difference = high - low
+            result = np.where(weight >= 0.5, high - difference * (1 - weight), low + difference * weight) # Same rounding as numpy
+        quantiles.append(np.where(count > 0, result, np.nan))
+    return quantiles[0] if np.ndim(q) == 0 else np.array(quantiles)
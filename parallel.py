@@ -0,0 +1,30 @@
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser
+import os
+
+# Process-pool execution for independent tasks (symbols, intervals or interval pairs).
+# workers = 1 runs everything serially in the current process, which keeps breakpoints and tracebacks simple for debugging.
+
+def run_tasks(function, tasks, workers = 1, chunksize = 1): # Run function(*task) for every task. Results keep the order of tasks, so output does not depend on the number of workers.
+    tasks = list(tasks)
+    if workers == 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers = min(workers, len(tasks))) as executor:
+        return list(executor.map(function, *zip(*tasks), chunksize = chunksize))
+
+def get_workers(): # Get number of workers from the command line (--workers N, 0 = all cores, default 1 = serial)
+    parser = ArgumentParser()
+    parser.add_argument("--workers", type = int, default = 1, help = "number of worker processes (0 = all cores, 1 = serial)")
+    workers = parser.parse_known_args()[0].workers
+    return os.cpu_count() if workers == 0 else workers
+
+def get_option(name, type = int, default = None): # Get value of an option (for example --window 50) from the command line
+    parser = ArgumentParser()
+    parser.add_argument(name, type = type, default = default)
+    return vars(parser.parse_known_args()[0])[name.lstrip("-").replace("-", "_")]
+
+def get_flag(name): # Check if a flag (for example --intrabar) is set on the command line
+    parser = ArgumentParser()
+    parser.add_argument(name, action = "store_true")
+    return vars(parser.parse_known_args()[0])[name.lstrip("-").replace("-", "_")]
@@ -0,0 +1,213 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from importlib import import_module
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import pandas as pd
+import numpy as np
+import tracemalloc
+import platform
+import json
+import io
+import os
+import sys
+import kline_store
+import benchmark_series
+import resample_engine
+import trade_store
+import calculate_returns
+import strategy_standard_deviation
+
+# Reproducible performance benchmarks on synthetic market data (offline, no Bybit access).
+# A seeded generator writes symbols x candles of 5 minute klines and the benchmark series into a temporary directory, then every
+# pipeline stage is timed and its peak memory (tracemalloc) is recorded. Results are saved as json baselines and can be compared later.
+# > python perf_suite.py --scales small medium --save perf/baseline.json
+# > python perf_suite.py --scales small medium --compare perf/baseline.json
+strategy_time_series = import_module("strategy_time-series")
+
+SCALES = {
+    "small": {"symbols": 12, "candles": 10000}
+    , "medium": {"symbols": 24, "candles": 50000}
+    , "large": {"symbols": 48, "candles": 200000}
+}
+INTERVALS = [
+    5
+    , 15
+    , 30
+    , 60
+    , 120
+    , 240
+    , 360
+    , 720
+    , 1440
+]
+SIGMAS = (1.0, 1.5, 2.0, 2.5, 3.0)
+BENCHMARKS = [
+    "US_30D_TBILL_D"
+    , "SP500_D"
+    , "CRYPTOMARKETCAP_D"
+]
+
+def generate_klines(symbols, candles, seed = 0, start_time = 1600000000000): # Write seeded random walks of 5 minute klines. Symbols are listed at different times like real ones.
+    rng = np.random.default_rng(seed)
+    start_time = start_time // 86400000 * 86400000
+    for number in range(symbols):
+        rows = candles - int(rng.integers(0, candles // 4 + 1))
+        change = rng.normal(0, 0.003, rows)
+        close = 10 * np.exp(np.cumsum(change))
+        open = np.concatenate([[10.0], close[:-1]])
+        volume = rng.lognormal(8, 1, rows)
+        kline_store.save_klines(pd.DataFrame({
+            "start_time": start_time + (candles - rows + np.arange(rows, dtype = "int64")) * 5 * 60 * 1000
+            , "open": open
+            , "high": np.maximum(open, close) * (1 + np.abs(rng.normal(0, 0.001, rows)))
+            , "low": np.minimum(open, close) * (1 - np.abs(rng.normal(0, 0.001, rows)))
+            , "close": close
+            , "volume": volume
+            , "turnover": volume * close
+        }), f"S{number:03d}USDT", 5)
+
+    os.makedirs("03_returns/benchmark", exist_ok = True)
+    days = candles * 5 // 1440 + 2
+    for file in BENCHMARKS: # Daily series in unix seconds. The T-bill series is a rate in percent.
+        close = 4 + np.cumsum(rng.normal(0, 0.01, days)) if file == "US_30D_TBILL_D" else 100 * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+        open = np.concatenate([close[:1], close[:-1]])
+        pd.DataFrame({
+            "time": start_time // 1000 + np.arange(days) * 86400
+            , "open": open
+            , "high": np.maximum(open, close)
+            , "low": np.minimum(open, close)
+            , "close": close
+        }).to_csv(f"03_returns/benchmark/{file}.csv", index = False)
+    os.makedirs("03_returns/portfolio/ts", exist_ok = True)
+
+def get_stages(intervals): # Get (name, function) of all stages in pipeline order. Every stage only reads what earlier stages wrote and can run repeatedly.
+    state = {}
+    symbols = lambda: [symbol for symbol, _ in kline_store.list_klines(intervals[0])]
+
+    def resample():
+        for symbol in symbols():
+            resample_engine.update_resampled(symbol, intervals[0], intervals[1:], incremental = False)
+
+    def top_performers():
+        state["signals"] = {interval: strategy_time_series.get_signals(interval) for interval in intervals}
+
+    def ts_trades():
+        for symbol in symbols():
+            signals = {interval: df_top_performers[df_top_performers["symbol"] == symbol] for interval, df_top_performers in state["signals"].items()}
+            strategy_time_series.calculate_trades(symbol, signals, intervals)
+
+    def sd_trades():
+        for symbol in symbols():
+            strategy_standard_deviation.calculate_symbol_trades(symbol, intervals, SIGMAS, intervals)
+
+    def returns():
+        for strategy, symbol in trade_store.list_trades():
+            calculate_returns.get_partition_returns(strategy, symbol)
+
+    def portfolio():
+        for prepare_interval in intervals:
+            for holding_interval in intervals:
+                calculate_returns.create_interval_portfolio("ts", prepare_interval, holding_interval)
+
+    return [
+        ("resample", resample)
+        , ("top_performers", top_performers)
+        , ("ts_trades", ts_trades)
+        , ("sd_trades", sd_trades)
+        , ("returns", returns)
+        , ("portfolio", portfolio)
+    ]
+
+def measure(function, repeat = 1): # Get (best seconds of repeat runs, peak MB of one traced run). Time is measured without tracing, which slows down allocations.
+    seconds = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        seconds.append(perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(seconds), peak / 1e6
+
+def run_scale(symbols, candles, intervals = INTERVALS, seed = 0, repeat = 1): # Generate one scale in a temporary directory and measure every stage
+    directory = os.getcwd()
+    results = {}
+    with TemporaryDirectory() as temporary_directory:
+        os.chdir(temporary_directory)
+        benchmark_series.get_benchmark.cache_clear() # Benchmarks are cached by file name
+        try:
+            with redirect_stdout(io.StringIO()): # The stages print progress per symbol
+                generate_klines(symbols, candles, seed)
+                for stage, function in get_stages(intervals):
+                    seconds, peak_mb = measure(function, repeat)
+                    results[stage] = {"seconds": round(seconds, 4), "peak_mb": round(peak_mb, 2)}
+        finally:
+            os.chdir(directory)
+    return results
+
+def run_suite(scales, intervals = INTERVALS, seed = 0, repeat = 1):
+    baseline = {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__, "machine": platform.machine()}
+        , "seed": seed
+        , "scales": {}
+    }
+    for name, scale in scales.items():
+        print(f"[PERF] {name}: {scale['symbols']} symbols x {scale['candles']} candles")
+        baseline["scales"][name] = dict(scale, intervals = list(intervals), stages = run_scale(scale["symbols"], scale["candles"], intervals, seed, repeat))
+    return baseline
+
+def compare(baseline, current, tolerance = 0.25, minimum_seconds = 0.5): # Get comparison of every stage. A stage regresses if time or memory grew by more than tolerance (stages faster than minimum_seconds are too noisy to judge on time).
+    rows = []
+    for name, scale in current["scales"].items():
+        stages = baseline["scales"].get(name, {}).get("stages", {})
+        for stage, result in scale["stages"].items():
+            if stage not in stages:
+                continue
+            time_ratio = result["seconds"] / max(stages[stage]["seconds"], 1e-9)
+            memory_ratio = result["peak_mb"] / max(stages[stage]["peak_mb"], 1e-9)
+            regression = (time_ratio > 1 + tolerance and result["seconds"] >= minimum_seconds) or memory_ratio > 1 + tolerance
+            rows.append([name, stage, stages[stage]["seconds"], result["seconds"], time_ratio, stages[stage]["peak_mb"], result["peak_mb"], memory_ratio, regression])
+    return pd.DataFrame(rows, columns = ["scale", "stage", "baseline_seconds", "seconds", "time_ratio", "baseline_peak_mb", "peak_mb", "memory_ratio", "regression"])
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--scales", nargs = "+", default = ["small"], help = f"named scales ({', '.join(SCALES)})")
+    parser.add_argument("--symbols", type = int, help = "custom scale: number of symbols (with --candles)")
+    parser.add_argument("--candles", type = int, help = "custom scale: number of 5 minute candles per symbol")
+    parser.add_argument("--intervals", type = int, nargs = "+", default = INTERVALS, help = "intervals in minutes, the first one is the base interval")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--repeat", type = int, default = 1, help = "timed runs per stage, the best one counts")
+    parser.add_argument("--save", help = "write results to this json file")
+    parser.add_argument("--compare", help = "compare results with this json baseline, exit code 1 on regressions")
+    parser.add_argument("--tolerance", type = float, default = 0.25, help = "allowed growth of time and memory (0.25 = 25%%)")
+    arguments = parser.parse_args()
+
+    scales = {name: SCALES[name] for name in arguments.scales}
+    if arguments.symbols is not None and arguments.candles is not None:
+        scales = {"custom": {"symbols": arguments.symbols, "candles": arguments.candles}}
+
+    current = run_suite(scales, sorted(arguments.intervals), arguments.seed, arguments.repeat)
+    df_results = pd.DataFrame([dict(scale = name, stage = stage, **result) for name, scale in current["scales"].items() for stage, result in scale["stages"].items()])
+    print(df_results.to_string(index = False))
+
+    if arguments.save is not None:
+        if os.path.dirname(arguments.save) != "":
+            os.makedirs(os.path.dirname(arguments.save), exist_ok = True)
+        with open(arguments.save, "w", encoding = "utf-8") as f:
+            json.dump(current, f, indent = 1)
+        print(f"[PERF] Saved results. ({arguments.save})")
+
+    if arguments.compare is not None:
+        with open(arguments.compare, encoding = "utf-8") as f:
+            df_comparison = compare(json.load(f), current, arguments.tolerance)
+        print(df_comparison.to_string(index = False))
+        if df_comparison["regression"].any():
+            print(f"[!] {int(df_comparison['regression'].sum())} stage(s) regressed.")
+            sys.exit(1)
+        print("[PERF] No regressions.")
+
+if __name__ == "__main__":
+    main()
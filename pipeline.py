@@ -0,0 +1,224 @@
+from hashlib import sha1
+from glob import glob
+from importlib import import_module
+from time import time
+from fetch_engine import KlineClient
+import pandas as pd
+import json
+import os
+import download_data
+import resample_engine
+import kline_store
+import trade_store
+import calculate_returns
+import strategy_standard_deviation
+import parallel
+import instrumentation
+import bootstrap
+import results_store
+import schemas
+
+# Incremental pipeline runner: download -> resample -> strategy trades -> returns.
+# Every task works on one partition and is keyed by the content hashes of its inputs and its parameters. Tasks whose key did not
+# change since the last run are skipped and their cached outputs are reused. The runner reports what ran, what was skipped and why.
+# > python pipeline.py [--workers N]
+strategy_time_series = import_module("strategy_time-series")
+
+STATE_DIRECTORY = ".pipeline"
+INTERVALS = [
+    5
+    , 15
+    , 30
+    , 60
+    , 120
+    , 240
+    , 360
+    , 720
+    , 1440
+]
+
+class Manifest: # Content hashes of partitions and keys of finished tasks, kept between runs
+    def __init__(self, path = f"{STATE_DIRECTORY}/manifest.json"):
+        self.path = path
+        self.state = {"files": {}, "tasks": {}}
+        if os.path.exists(path):
+            with open(path, encoding = "utf-8") as f:
+                self.state = json.load(f)
+
+    def hash_file(self, path): # Get content hash of a file. Files with the same size and modification time are not hashed again.
+        stat = os.stat(path)
+        cached = self.state["files"].get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        content_hash = sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                content_hash.update(block)
+        self.state["files"][path] = [stat.st_size, stat.st_mtime_ns, content_hash.hexdigest()]
+        return content_hash.hexdigest()
+
+    def hash_partition(self, partition): # Get content hash of all column files of a partition ("missing" if it does not exist)
+        files = sorted(glob(f"{partition}/*.bin"))
+        if len(files) == 0:
+            return "missing"
+        return sha1("".join(self.hash_file(file) for file in files).encode("utf-8")).hexdigest()
+
+    def check(self, task, inputs, parameters, outputs = ()): # Check if a task has to run. Returns (run, reason).
+        previous = self.state["tasks"].get(task)
+        if previous is None:
+            return True, "new"
+        if previous["parameters"] != parameters:
+            return True, "parameters changed"
+        changed = sorted(name for name in set(inputs) | set(previous["inputs"]) if inputs.get(name) != previous["inputs"].get(name))
+        if len(changed) > 0:
+            return True, f"input changed: {changed[0]}" + (f" (+{len(changed) - 1} more)" if len(changed) > 1 else "")
+        if not all(os.path.exists(output) for output in outputs):
+            return True, "output missing"
+        return False, "inputs unchanged"
+
+    def done(self, task, inputs, parameters): # Remember inputs of a finished task
+        self.state["tasks"][task] = {"inputs": inputs, "parameters": parameters}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        with open(self.path, "w", encoding = "utf-8") as f:
+            json.dump(self.state, f)
+
+class Report: # What ran and what was skipped, with reasons
+    def __init__(self):
+        self.entries = []
+
+    def add(self, stage, partition, run, reason):
+        self.entries.append({"stage": stage, "partition": partition, "action": "run" if run else "skip", "reason": reason})
+
+    def show(self, path = f"{STATE_DIRECTORY}/report.json"):
+        df_report = pd.DataFrame(self.entries, columns = ["stage", "partition", "action", "reason"])
+        print(df_report.groupby(["stage", "action", "reason"], sort = False).size().to_string())
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        df_report.to_json(path, orient = "records", indent = 1)
+
+def plan(manifest, report, stage, tasks): # Decide for every task (partition, inputs, parameters, outputs) if it has to run
+    runs = []
+    for partition, inputs, parameters, outputs in tasks:
+        run, reason = manifest.check(f"{stage}:{partition}", inputs, parameters, outputs)
+        report.add(stage, partition, run, reason)
+        if run:
+            runs.append((partition, inputs, parameters))
+    return runs
+
+def run_download(client, symbols, incremental): # Download always asks Bybit for new candles (external source). Only symbols with new rows count as changed.
+    unix_last = int(86400 * int(time() / 86400)) * 1000
+    rows = client.map_symbols(lambda symbol: download_data.download_symbol(client, symbol, 5, unix_last, incremental), symbols)
+    return dict(zip(symbols, rows))
+
+def run_resample(manifest, report, symbols, workers):
+    tasks = [(symbol, {"base": manifest.hash_partition(kline_store.get_partition_path(symbol, 5))}, {"intervals": resample_engine.INTERVALS}, [kline_store.get_partition_path(symbol, interval) for interval in resample_engine.INTERVALS]) for symbol in symbols]
+    runs = plan(manifest, report, "resample", tasks)
+    parallel.run_tasks(resample_engine.update_resampled, [(symbol, 5) for symbol, _, _ in runs], workers)
+    for symbol, inputs, parameters in runs:
+        manifest.done(f"resample:{symbol}", inputs, parameters)
+
+def get_kline_inputs(manifest, symbol): # Get hashes of all intervals of a symbol
+    return {f"{symbol}_{interval}": manifest.hash_partition(kline_store.get_partition_path(symbol, interval)) for interval in INTERVALS}
+
+def run_standard_deviation(manifest, report, symbols, sigmas, rolling, window, workers):
+    parameters = {"sigmas": list(sigmas), "rolling": rolling, "window": window, "precision": schemas.get_precision()}
+    tasks = [(symbol, get_kline_inputs(manifest, symbol), parameters, [trade_store.get_partition_path("sd", symbol)]) for symbol in symbols]
+    runs = plan(manifest, report, "sd", tasks)
+    parallel.run_tasks(strategy_standard_deviation.calculate_symbol_trades, [(symbol, [interval for interval in INTERVALS if kline_store.exists(symbol, interval)], sigmas, INTERVALS, rolling, window) for symbol, _, _ in runs], workers)
+    for symbol, inputs, parameters in runs:
+        manifest.done(f"sd:{symbol}", inputs, parameters)
+
+def run_time_series(manifest, report, symbols, workers):
+    # The ranking of an interval depends on all symbols, so it runs if any symbol of the interval changed.
+    # Trades of a symbol only run again if its own signals or its klines changed.
+    os.makedirs(f"{STATE_DIRECTORY}/signals", exist_ok = True)
+    tasks = [(interval, {symbol: manifest.hash_partition(kline_store.get_partition_path(symbol, interval)) for symbol in symbols}, {"precision": schemas.get_precision()}, [f"{STATE_DIRECTORY}/signals/{interval}.pkl"]) for interval in INTERVALS]
+    runs = plan(manifest, report, "ts_signals", tasks)
+    for interval, df_top_performers in zip([interval for interval, _, _ in runs], parallel.run_tasks(strategy_time_series.get_signals, [(interval,) for interval, _, _ in runs], workers)):
+        df_top_performers.to_pickle(f"{STATE_DIRECTORY}/signals/{interval}.pkl")
+    for interval, inputs, parameters in runs:
+        manifest.done(f"ts_signals:{interval}", inputs, parameters)
+
+    symbol_signals = {}
+    for interval in INTERVALS:
+        df_top_performers = pd.read_pickle(f"{STATE_DIRECTORY}/signals/{interval}.pkl")
+        for symbol, group in df_top_performers.groupby("symbol", observed = True):
+            symbol_signals.setdefault(symbol, {})[interval] = group
+
+    tasks = []
+    for symbol in sorted(symbol_signals):
+        inputs = get_kline_inputs(manifest, symbol)
+        signals_hash = sha1()
+        for interval, group in symbol_signals[symbol].items(): # Hash values only, the row index depends on other symbols
+            signals_hash.update(f"{interval}:".encode("utf-8") + pd.util.hash_pandas_object(group[["start_time", "side"]], index = False).values.tobytes())
+        inputs["signals"] = signals_hash.hexdigest()
+        tasks.append((symbol, inputs, {"precision": schemas.get_precision()}, [trade_store.get_partition_path("ts", symbol)]))
+    runs = plan(manifest, report, "ts", tasks)
+    parallel.run_tasks(strategy_time_series.calculate_trades, [(symbol, symbol_signals[symbol], INTERVALS) for symbol, _, _ in runs], workers)
+    for symbol, inputs, parameters in runs:
+        manifest.done(f"ts:{symbol}", inputs, parameters)
+
+def get_benchmark_inputs(manifest): # Get content hashes of the benchmark series the Sharpe ratios are measured against
+    return {os.path.basename(file): manifest.hash_file(file) for file in sorted(glob("03_returns/benchmark/*.csv"))}
+
+def run_returns(manifest, report, strategies, workers): # Returns of every trade partition are cached, returns.csv is assembled from the cache
+    benchmarks = get_benchmark_inputs(manifest) # A refreshed benchmark changes the Sharpe ratios of every partition
+    frames = []
+    for strategy in strategies:
+        partitions = trade_store.list_trades(strategy)
+        parameters = {"bootstrap": [bootstrap.get_samples(), bootstrap.BLOCK_SIZE, bootstrap.SEED]} # Cached returns include the bootstrap columns
+        tasks = [(symbol, {"trades": manifest.hash_partition(trade_store.get_partition_path(strategy, symbol)), **benchmarks}, parameters, [f"{STATE_DIRECTORY}/returns/{strategy}/{symbol}.pkl"]) for _, symbol in partitions]
+        runs = plan(manifest, report, f"returns_{strategy}", tasks)
+
+        os.makedirs(f"{STATE_DIRECTORY}/returns/{strategy}", exist_ok = True)
+        for (symbol, inputs, parameters), df_returns in zip(runs, parallel.run_tasks(calculate_returns.get_partition_returns, [(strategy, symbol) for symbol, _, _ in runs], workers)):
+            df_returns.to_pickle(f"{STATE_DIRECTORY}/returns/{strategy}/{symbol}.pkl")
+            manifest.done(f"returns_{strategy}:{symbol}", inputs, parameters)
+        frames = frames + [pd.read_pickle(f"{STATE_DIRECTORY}/returns/{strategy}/{symbol}.pkl") for _, symbol in partitions]
+
+        if strategy == "ts": # Portfolios combine all symbols
+            inputs = {symbol: manifest.hash_partition(trade_store.get_partition_path(strategy, symbol)) for _, symbol in partitions}
+            inputs.update(benchmarks)
+            for partition, _, parameters in plan(manifest, report, "portfolio", [(strategy, inputs, parameters, ["03_returns/portfolio_returns.csv"])]):
+                os.makedirs(f"03_returns/portfolio/{strategy}", exist_ok = True)
+                calculate_returns.get_portfolio_returns(strategy, workers)
+                manifest.done(f"portfolio:{partition}", inputs, parameters)
+
+    if len(frames) > 0:
+        df_returns = pd.concat(frames, ignore_index = True)
+        instrumentation.write_csv(df_returns, "03_returns/returns.csv", index = False) # Written as a whole, so reruns never duplicate rows
+        results_store.save_returns(df_returns)
+
+def run_pipeline(download = True, incremental = True, sigmas = (1.0, 1.5, 2.0, 2.5, 3.0), rolling = False, window = None, workers = 1):
+    manifest = Manifest()
+    report = Report()
+    instrumentation.start_run("pipeline")
+    schemas.configure()
+
+    if download:
+        client = KlineClient()
+        symbols = download_data.get_symbols(client)
+        with instrumentation.stage("download"):
+            rows = run_download(client, symbols, incremental)
+        for symbol in symbols:
+            report.add("download", symbol, rows[symbol] > 0, f"{rows[symbol]} new rows")
+    symbols = [symbol for symbol, _ in kline_store.list_klines(5)]
+
+    try:
+        with instrumentation.stage("resample"):
+            run_resample(manifest, report, symbols, workers)
+        with instrumentation.stage("sd"):
+            run_standard_deviation(manifest, report, symbols, sigmas, rolling, window, workers)
+        with instrumentation.stage("ts"):
+            run_time_series(manifest, report, symbols, workers)
+        with instrumentation.stage("returns"):
+            run_returns(manifest, report, ["ts", "sd"], workers)
+    finally: # Keep finished tasks even if a later one fails
+        manifest.save()
+        report.show()
+
+if __name__ == "__main__":
+    window = parallel.get_option("--window")
+    run_pipeline(rolling = parallel.get_flag("--rolling") or window is not None, window = window, workers = parallel.get_workers())
@@ -0,0 +1,45 @@
+import numpy as np
+import kline_store
+
+# Range minimum/maximum index (sparse table). Building it takes O(n log n) once, after which every range query takes O(1).
+# Queries are batched: first and last are arrays of row ranges [first, last), so all trades of a strategy run are answered at once.
+class SparseTable:
+    def __init__(self, values, function = np.minimum): # function is np.minimum or np.maximum (NaN-safe variants np.fmin/np.fmax work as well)
+        self.function = function
+        self.levels = [np.asarray(values, dtype = "float64")] # levels[k][i] = function over values[i:i + 2^k]
+        while 2 ** len(self.levels) <= self.levels[0].shape[0]:
+            previous = self.levels[-1]
+            width = 2 ** (len(self.levels) - 1)
+            self.levels.append(function(previous[:-width], previous[width:]))
+
+    def query(self, first, last): # Get function over values[first:last] for every range (NaN for empty ranges)
+        first = np.asarray(first, dtype = "int64")
+        last = np.asarray(last, dtype = "int64")
+        empty = last <= first
+        size = np.where(empty, 1, last - first)
+        level = np.floor(np.log2(size)).astype("int64") # Two overlapping blocks of 2^level values cover the range
+        result = np.full(first.shape, np.nan)
+
+        for k in np.unique(level[~empty]):
+            rows = ~empty & (level == k)
+            result[rows] = self.function(self.levels[k][first[rows]], self.levels[k][last[rows] - 2 ** k])
+        return result[()]
+
+class RangeIndex: # Highest high and lowest low of the base candles of a symbol between any two times
+    def __init__(self, start_time, high, low):
+        self.start_time = np.asarray(start_time, dtype = "int64")
+        self.high = SparseTable(high, np.fmax)
+        self.low = SparseTable(low, np.fmin)
+
+    def get_rows(self, entry_time, exit_time): # Get rows [first, last) of all base candles starting in [entry_time, exit_time)
+        first = np.searchsorted(self.start_time, np.asarray(entry_time, dtype = "int64"), side = "left")
+        last = np.searchsorted(self.start_time, np.asarray(exit_time, dtype = "int64"), side = "left")
+        return first, last
+
+    def get_extremes(self, entry_time, exit_time): # Get (highest high, lowest low) between entry and exit of every trade (NaN without base candles)
+        first, last = self.get_rows(entry_time, exit_time)
+        return self.high.query(first, last), self.low.query(first, last)
+
+def get_range_index(symbol, base_interval = 5): # Get range index over the base candles of a symbol (memory-mapped, so only high and low are read)
+    data = kline_store.read_columns(symbol, base_interval, ["start_time", "high", "low"])
+    return RangeIndex(data["start_time"], data["high"], data["low"])
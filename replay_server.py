@@ -0,0 +1,43 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import urlparse, parse_qsl
+from fetch_engine import get_record_path
+import json
+import os
+import sys
+
+# Local stand-in for the Bybit API. Replays responses that were recorded with KlineClient(record_directory = ...).
+# > python replay_server.py <record_directory> [port]
+# and point the downloader at it with KlineClient(base_url = "http://127.0.0.1:<port>").
+
+def create_handler(directory):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            path = get_record_path(directory, url.path, dict(parse_qsl(url.query)))
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    body = f.read()
+            else: # Answer like Bybit does for requests it cannot serve
+                body = json.dumps({"retCode": 10001, "retMsg": f"No recorded response for {self.path}", "result": {}}).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): # Keep output quiet
+            pass
+
+    return ReplayHandler
+
+def start_replay_server(directory, port = 0): # Start server in a background thread. Returns server and its base url.
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(directory))
+    Thread(target = server.serve_forever, daemon = True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", int(sys.argv[2]) if len(sys.argv) > 2 else 8000), create_handler(sys.argv[1]))
+    print(f"Replaying {sys.argv[1]} on http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,65 @@
+import pandas as pd
+import numpy as np
+import kline_store
+
+# Resampling engine. Builds all intervals from the base candles in one pass: every interval is aggregated from the largest
+# interval already built that divides it (5 -> 15 -> 30 -> 60 -> 120 -> 240, 120 -> 360 -> 720 -> 1440) with vectorized segment reductions.
+INTERVALS = [
+    15
+    , 30
+    , 60
+    , 120
+    , 240
+    , 360
+    , 720
+    , 1440
+]
+
+def get_segments(start_time, interval): # Get first row of every bucket. Rows have to be sorted by start_time.
+    bucket = start_time // (interval * 60 * 1000)
+    return np.flatnonzero(np.concatenate([[True], bucket[1:] != bucket[:-1]])) if bucket.shape[0] > 0 else np.empty(0, dtype = "int64")
+
+def aggregate(columns, interval): # Aggregate columns into buckets of interval (first/max/min/last/sum)
+    starts = get_segments(columns["start_time"], interval)
+    if starts.shape[0] == 0:
+        return {column: values[:0] for column, values in columns.items()}
+    ends = np.concatenate([starts[1:], [columns["start_time"].shape[0]]]) - 1
+
+    return {
+        "start_time": columns["start_time"][starts]
+        , "open": columns["open"][starts]
+        , "high": np.maximum.reduceat(columns["high"], starts)
+        , "low": np.minimum.reduceat(columns["low"], starts)
+        , "close": columns["close"][ends]
+        , "volume": np.add.reduceat(columns["volume"], starts)
+        , "turnover": np.add.reduceat(columns["turnover"], starts)
+    }
+
+def resample_all(columns, base_interval, intervals = INTERVALS): # Get columns of all intervals. Empty buckets are left out.
+    resampled = {base_interval: columns}
+    for interval in sorted(intervals):
+        source = max(source for source in resampled if interval % source == 0) # Largest interval already built that fits into interval
+        resampled[interval] = aggregate(resampled[source], interval)
+    del resampled[base_interval]
+    return resampled
+
+def update_resampled(symbol, base_interval, intervals = INTERVALS, incremental = True): # Resample stored base candles of a symbol into all intervals. Incremental mode only re-aggregates buckets from the last stored bucket onward.
+    bucket_starts = {}
+    for interval in intervals:
+        last_start_time = kline_store.get_last_start_time(symbol, interval) if incremental else None
+        bucket_size = interval * 60 * 1000
+        bucket_starts[interval] = 0 if last_start_time is None else last_start_time // bucket_size * bucket_size # Last bucket may have been incomplete, so it is aggregated again
+
+    base = kline_store.read_columns(symbol, base_interval)
+    first_row = np.searchsorted(base["start_time"], min(bucket_starts.values()))
+    resampled = resample_all({column: np.asarray(values[first_row:]) for column, values in base.items()}, base_interval, intervals)
+
+    rows = {}
+    for interval, columns in resampled.items():
+        stored_start_time = kline_store.read_columns(symbol, interval, ["start_time"])["start_time"] if kline_store.exists(symbol, interval) else np.empty(0, dtype = "int64")
+        kline_store.truncate_klines(symbol, interval, np.searchsorted(stored_start_time, bucket_starts[interval])) # Drop buckets that are aggregated again
+        del stored_start_time
+
+        new_rows = np.searchsorted(columns["start_time"], bucket_starts[interval])
+        rows[interval] = kline_store.append_klines(pd.DataFrame({column: values[new_rows:] for column, values in columns.items()}), symbol, interval)
+    return rows
@@ -0,0 +1,98 @@
+from argparse import ArgumentParser
+import pandas as pd
+import numpy as np
+import instrumentation
+import os
+
+# Explicit in-memory schemas of kline, signal and trade frames (instead of the type inference of pd.read_csv).
+# Times are int64 unix milliseconds, prices float64 or float32 (--precision float32 halves their memory), side is bool and
+# symbol/strategy are categorical, so a cross section of millions of rows holds one small code per row instead of a Python string.
+# Returns, drawdowns and sigmas always stay float64. The TS cross section is ranked in time chunks that fit into the memory budget (--memory-budget MB).
+# Settings go to environment variables, so worker processes use the same ones.
+# > python strategy_time-series.py --precision float32 --memory-budget 512
+PRECISION = "float64"
+MEMORY_BUDGET = 1024 # MB
+
+KLINES = {
+    "start_time": "time"
+    , "open": "price"
+    , "high": "price"
+    , "low": "price"
+    , "close": "price"
+    , "volume": "price"
+    , "turnover": "price"
+    , "symbol": "category"
+}
+SIGNALS = {
+    "start_time": "time"
+    , "symbol": "category"
+    , "side": "bool"
+}
+TRADES = {
+    "entry_time": "time"
+    , "prepare_interval": "int64"
+    , "holding_interval": "int64"
+    , "sigma": "float64"
+    , "entry_price": "price"
+    , "exit_time": "time"
+    , "exit_price": "price"
+    , "max_drawdown": "float64"
+    , "return": "float64"
+    , "side": "bool"
+    , "strategy": "category"
+    , "symbol": "category"
+}
+PORTFOLIO = {
+    "entry_time": "time"
+    , "exit_time": "time"
+    , "return": "float64"
+    , "max_drawdown": "float64"
+}
+
+def configure(): # Read --precision and --memory-budget from the command line (defaults from the environment, set by the parent process)
+    parser = ArgumentParser()
+    parser.add_argument("--precision", choices = ["float64", "float32"], default = os.environ.get("BA_PRECISION", PRECISION), help = "dtype of prices in memory")
+    parser.add_argument("--memory-budget", type = float, default = float(os.environ.get("BA_MEMORY_BUDGET", MEMORY_BUDGET)), help = "MB the TS cross section of one chunk may take")
+    arguments = parser.parse_known_args()[0]
+
+    os.environ["BA_PRECISION"] = arguments.precision
+    os.environ["BA_MEMORY_BUDGET"] = str(arguments.memory_budget)
+    return arguments.precision, arguments.memory_budget
+
+def get_precision(): # Get dtype of prices
+    return os.environ["BA_PRECISION"] if "BA_PRECISION" in os.environ else configure()[0]
+
+def get_memory_budget(): # Get memory budget in bytes
+    return int((float(os.environ["BA_MEMORY_BUDGET"]) if "BA_MEMORY_BUDGET" in os.environ else configure()[1]) * 1e6)
+
+def get_dtypes(schema, columns = None, precision = None): # Get dtype of every column ("category" for categorical columns)
+    precision = get_precision() if precision is None else precision
+    columns = list(schema) if columns is None else columns
+    kinds = {"time": "int64", "price": precision, "bool": "bool", "category": "category"}
+    return {column: kinds.get(schema[column], schema[column]) for column in columns}
+
+def get_row_bytes(schema, columns = None, precision = None): # Get estimated bytes of one row (categorical columns count as int32 codes)
+    return sum(4 if dtype == "category" else np.dtype(dtype).itemsize for dtype in get_dtypes(schema, columns, precision).values())
+
+def apply_schema(df, schema, precision = None): # Cast all columns of the schema that df holds. Columns that already have their dtype are not copied.
+    dtypes = get_dtypes(schema, [column for column in df.columns if column in schema], precision)
+    return df.astype({column: dtype for column, dtype in dtypes.items() if df[column].dtype != dtype})
+
+def get_categorical(value, rows): # Get categorical column of one repeated value (one code per row, no Python strings)
+    return pd.Categorical.from_codes(np.zeros(rows, dtype = "int8"), [value])
+
+def concat_frames(frames, schema, precision = None): # Concat typed frames. Categorical columns get the union of all categories, so they stay categorical instead of turning into strings.
+    frames = [apply_schema(df, schema, precision) for df in frames]
+    if len(frames) == 0:
+        return pd.DataFrame({column: pd.Series(dtype = dtype) for column, dtype in get_dtypes(schema, precision = precision).items()})
+
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = sorted(set().union(*[df[column].cat.categories for df in frames]))
+            frames = [df.assign(**{column: df[column].cat.set_categories(categories)}) for df in frames]
+    return pd.concat(frames, ignore_index = True)
+
+def read_csv(file, schema, columns = None, precision = None): # Read a csv file with the dtypes of the schema instead of type inference
+    columns = pd.read_csv(file, encoding = "utf-8", nrows = 0).columns.tolist() if columns is None else columns
+    dtypes = {column: dtype for column, dtype in get_dtypes(schema, [column for column in columns if column in schema], precision).items() if dtype != "category"}
+    return apply_schema(instrumentation.read_csv(file, encoding = "utf-8", usecols = columns, dtype = dtypes)[columns], schema, precision)
@@ -1,13 +1,39 @@
-from glob import glob
 import pandas as pd
 import numpy as np
-from os.path import basename
+import kline_store
+import trade_store
+import trade_kernel
+import parallel
+import volatility
+import range_index
+import instrumentation
+import schemas
 
-def get_trading_signal(df_kline, sigma): # Get trading signal
+def get_standard_deviation(change, rolling = False, window = None): # Get standard deviation (ddof = 0) of change for every candle
+    # Default: one standard deviation of the full sample (includes future candles).
+    # rolling = True: only candles before each candle count, over the last "window" candles (all earlier candles if window is None).
+    if not rolling:
+        return np.full(change.shape[0], np.nanstd(change))
+    return volatility.get_past_standard_deviation(change, window)
+
+def update_trading_signal(estimator, change, sigma): # Get side of a new candle (True, None or False) from a volatility.RollingStandardDeviation of the earlier candles, then add the candle to it in constant time
+    standard_deviation = sigma * estimator.get()
+    if estimator.seen < 11: # Same as dropping the first 11 rows (count is capped by the window)
+        side = None
+    elif change >= standard_deviation:
+        side = True
+    elif change <= -standard_deviation:
+        side = False
+    else:
+        side = None
+    estimator.update(change)
+    return side
+
+def get_trading_signal(df_kline, sigma, rolling = False, window = None): # Get trading signal
     # Get standard deviation
     df_kline["change"] = df_kline["close"] / df_kline["open"] - 1
-    df_kline["standard_deviation"] = sigma * df_kline["change"].std(ddof = 0)
-    df_kline = df_kline.iloc[11:] # Drop first 11 rows as their standard deviation includes less than 10 samples
+    df_kline["standard_deviation"] = sigma * get_standard_deviation(df_kline["change"].to_numpy(), rolling, window)
+    df_kline = df_kline.iloc[11:].copy() # Drop first 11 rows as their standard deviation includes less than 10 samples
 
     # Get all candles that are "abnormal" (exceeding standard deviation)
     conditions = [
@@ -23,86 +49,85 @@ def get_trading_signal(df_kline, sigma): # Get trading signal
     df_kline["side"] = np.select(conditions, choices, default = None)
     return df_kline
 
-def filter_trades(df_group): # Filter trades of the same trading time. Remove positions if they cancel out (Long/Short)
-    longs = sum(df_group["side"])
-    shorts = len(df_group) - longs
-    if longs > shorts:
-        return df_group[df_group["side"] == True].iloc[:1]
-    elif longs < shorts:
-        return df_group[df_group["side"] == False].iloc[:1]
-    else:
-        return None
+def get_trading_signals(df_kline, sigmas, rolling = False, window = None): # Get trading signals of all sigmas at once. Returns formation candles and a 2-D side array (candles x sigmas) with 1 (long), -1 (short) and 0 (no trade).
+    change = (df_kline["close"] / df_kline["open"] - 1).to_numpy()
+    thresholds = get_standard_deviation(change, rolling, window)[:, np.newaxis] * np.asarray(sigmas, dtype = "float64") # Same standard deviation for every sigma
+    df_kline = df_kline.iloc[11:] # Drop first 11 rows as their standard deviation includes less than 10 samples
+    change = change[11:, np.newaxis]
+    thresholds = thresholds[11:]
 
-def get_trades(df_kline, df_kline_holding, prepare_interval): # Get all trades
-    # Merge formation period with holding period
-    df_kline = df_kline[["start_time", "side"]]
+    # Get all candles that are "abnormal" (exceeding standard deviation)
+    side = np.where(change >= thresholds, 1, np.where(change <= -thresholds, -1, 0)).astype("int8")
+    return df_kline, side
 
-    df_kline["earliest_holding_time"] = df_kline["start_time"] + (prepare_interval * 60 * 1000)
-    df_kline_holding["open_time_holding"] = df_kline_holding["start_time"]
-    df_kline_holding["close_time_holding"] = df_kline_holding["start_time"].shift(-1)
+def filter_trades_vectorized(df_kline): # Filter trades of the same trading time: keep one position on the side with more signals, none if longs and shorts cancel out
+    side = df_kline["side"].astype(bool)
+    longs = side.groupby(df_kline["open_time_holding"]).transform("sum")
+    shorts = side.groupby(df_kline["open_time_holding"]).transform("size") - longs
+    net_side = np.sign(longs - shorts) # 1: more longs, -1: more shorts, 0: positions cancel out
+
+    df_kline = df_kline[(net_side != 0) & (side == (net_side > 0))] # Keep positions on the winning side
+    df_kline = df_kline.drop_duplicates(subset = ["open_time_holding"], keep = "first") # Only keep the first position per trading time
+    return df_kline.sort_values(by = ["open_time_holding"], kind = "stable").reset_index(drop = True)
+
+def align_holding(df_kline, df_kline_holding, prepare_interval): # Merge formation period with holding period
+    df_kline = df_kline.assign(earliest_holding_time = df_kline["start_time"] + (prepare_interval * 60 * 1000))
+    df_kline_holding = df_kline_holding.assign(open_time_holding = df_kline_holding["start_time"], close_time_holding = df_kline_holding["start_time"].shift(-1))
     df_kline_holding = df_kline_holding.dropna()
 
     df_kline = pd.merge_asof(df_kline, df_kline_holding, left_on = "earliest_holding_time", right_on = "start_time", direction = "forward")
-    df_kline = df_kline.dropna()
-    
+    return df_kline.dropna()
+
+def get_trades(df_kline, df_kline_holding, prepare_interval): # Get all trades
+    df_kline = align_holding(df_kline[["start_time", "side"]], df_kline_holding, prepare_interval)
+    return cost_trades(df_kline)
+
+def cost_trades(df_kline, range_index = None): # Turn aligned signals into trades
     # Check for multiple trades at the same time and only keep one position. Do not trade at all if they cancel out.
-    df_kline = df_kline.groupby("open_time_holding", group_keys = True).apply(filter_trades).reset_index(drop = True)
-    
-    try:
-        # Calculate max drawdown
-        conditions = [
-            df_kline["side"] == True
-            , df_kline["side"] == False
-        ]
-        choices = [
-            df_kline["low"] / df_kline["open"] - 1
-            , 1 - df_kline["high"] / df_kline["open"]
-        ]
-
-        df_kline["max_drawdown"] = np.select(conditions, choices, default = None)
-
-        # Calculate return
-        trading_fee = 0.0006
-        funding_fee = 0.0001 # Base funding fee every 8 hours
-        
-        df_kline["funding_fee"] = 1 - (funding_fee * ((df_kline["close_time_holding"] - df_kline["open_time_holding"]) / (1000 * 60 * 60 * 8)))
-
-        choices = [
-            ((df_kline["close"] * (1 - trading_fee)) / (df_kline["open"] * ((1 + trading_fee))) - 1) * df_kline["funding_fee"]
-            , 1 - (df_kline["close"] * (1 + trading_fee)) / (df_kline["open"] * (1 - trading_fee)) * df_kline["funding_fee"]
-        ]
-        df_kline["return"] = np.select(conditions, choices, default = None)
-
-        df_kline["max_drawdown"][df_kline["max_drawdown"] < -1] = -1 # Max drawdown can only be 100% loss.
-        df_kline["return"][df_kline["max_drawdown"] == -1] = -1 # In case of max drawdown of more than 100%, position would get liquidated, even if it eventually retraces.
-        df_kline["return"][df_kline["return"] < -1] = -1 # Position would get liquidated before having negative balance.
-    except: # No trade
-        return pd.DataFrame()
-
-    df_kline = df_kline.copy().dropna()
-    
-    # Calculate trade-relevant metrics and show each trade as one row
-    df_kline["entry_price"] = df_kline["open"]
-    df_kline["exit_price"] = df_kline["close"]
-    df_trades = df_kline[["open_time_holding", "entry_price", "close_time_holding", "exit_price", "max_drawdown", "return", "side"]]
-    df_trades = df_trades.rename(columns = {"open_time_holding": "entry_time", "close_time_holding": "exit_time"})
-    df_trades = df_trades.dropna()
-    return df_trades
+    df_kline = filter_trades_vectorized(df_kline)
+    return trade_kernel.get_trades(df_kline, funding_fee = trade_kernel.FUNDING_FEE, range_index = range_index)
 
-def calculate_trades(df_kline, df_kline_holding, sigma, prepare_interval):
-    df_kline = get_trading_signal(df_kline, sigma) # Get trading signal
+def calculate_trades(df_kline, df_kline_holding, sigma, prepare_interval, rolling = False, window = None):
+    df_kline = get_trading_signal(df_kline, sigma, rolling, window) # Get trading signal
     df_trades = get_trades(df_kline, df_kline_holding, prepare_interval) # Get trades
     return df_trades
 
-def main():
-    files = glob("01_raw/*.csv")
-    sigmas = [
-        1.0
-        , 1.5
-        , 2.0
-        , 2.5
-        , 3.0
-    ]
+def net_signals(open_time_holding, side): # Get first row of every holding candle and the net side of all sigmas at once (holding candles x sigmas: 1 long, -1 short, 0 positions cancel out or no signal). Rows are ordered by open_time_holding.
+    if open_time_holding.shape[0] == 0:
+        return np.empty(0, dtype = "int64"), np.zeros((0, side.shape[1]), dtype = "int64")
+    first = np.flatnonzero(np.concatenate([[True], open_time_holding[1:] != open_time_holding[:-1]]))
+    return first, np.sign(np.add.reduceat(side.astype("int64"), first, axis = 0)) # Segment sums: longs - shorts per holding candle
+
+def calculate_trades_sweep(df_kline, df_kline_holding, sigmas, prepare_interval, rolling = False, window = None, range_index = None): # Get trades of all sigmas. Change, standard deviation, the holding alignment, the netting and the costs of every holding candle are only computed once.
+    df_kline, side = get_trading_signals(df_kline, sigmas, rolling, window)
+    df_kline = df_kline[["start_time"]].assign(row = np.arange(df_kline.shape[0]))
+    df_kline = align_holding(df_kline, df_kline_holding, prepare_interval)
+    side = side[df_kline["row"].to_numpy()]
+
+    # Prices and drawdown only depend on the holding candle, so every holding candle is costed once for long and short
+    first, net_side = net_signals(df_kline["open_time_holding"].to_numpy(), side)
+    frames = trade_kernel.get_side_trades(df_kline.iloc[first], net_side, funding_fee = trade_kernel.FUNDING_FEE, range_index = range_index)
+    return dict(zip(sigmas, frames))
+
+def calculate_symbol_trades(symbol, prepare_intervals, sigmas, intervals, rolling = False, window = None, intrabar = False): # Get trades of one symbol for all intervals and sigmas. Every file of the symbol is loaded once.
+    with instrumentation.stage("sd", symbol):
+        cache = kline_store.KlineCache(columns = ["start_time", "open", "high", "low", "close"])
+        index = range_index.get_range_index(symbol) if intrabar else None # Drawdown from the 5 minute candles instead of the holding candle
+        frames = []
+
+        for prepare_interval in prepare_intervals:
+            df_kline = cache.get(symbol, prepare_interval).copy() # Turn all files into Pandas Dataframes
+            print(symbol, prepare_interval)
+            for holding_interval in intervals:
+                df_kline_holding = cache.get(symbol, holding_interval).copy()
+                trades = calculate_trades_sweep(df_kline, df_kline_holding, sigmas, prepare_interval, rolling, window, index)
+                for sigma, df_trades in trades.items():
+                    frames.append((prepare_interval, holding_interval, sigma, df_trades))
+
+        trade_store.save_trades(frames, "sd", symbol) # Every partition belongs to exactly one symbol, so workers never write the same files
+
+def main(sigmas = (1.0, 1.5, 2.0, 2.5, 3.0), workers = 1, rolling = False, window = None, intrabar = False): # Signals, netting and costs of all sigmas are computed at once, only the trade frames are built per sigma. rolling = True uses only past candles for the standard deviation. intrabar = True takes drawdown and liquidation from the 5 minute candles.
+    files = kline_store.list_klines()
     intervals = [
         5
         , 15
@@ -114,21 +139,18 @@ def main():
         , 720
         , 1440
     ]
-    
-    for file in files: # Read all files
-        df_kline = pd.read_csv(file, encoding = "utf-8") # Turn all files into Pandas Dataframes
-        df_kline = df_kline.drop(columns = ["volume", "turnover"])
-        print(file)
-        for sigma in sigmas:
-            for holding_interval in intervals:
-                df_kline_holding = pd.read_csv(f"01_raw/{basename(file)[:basename(file).find('_')]}_{holding_interval}.csv", encoding = "utf-8")
-                df_kline_holding = df_kline_holding.drop(columns = ["volume", "turnover"])
-                prepare_interval = int(file[file.rfind("_") + 1:-4])
-                df_trades = calculate_trades(df_kline, df_kline_holding, sigma, prepare_interval)
-                df_trades.to_csv(f"02_strategy/sd/{sigma}/{basename(file)[:-4]}_{holding_interval}.csv", index_label = "trade")
+
+    prepare_intervals = {}
+    for symbol, prepare_interval in files: # Shard work by symbol
+        prepare_intervals.setdefault(symbol, []).append(prepare_interval)
+
+    instrumentation.start_run("sd")
+    schemas.configure()
+    with instrumentation.stage("sd"):
+        parallel.run_tasks(calculate_symbol_trades, [(symbol, symbol_intervals, sigmas, intervals, rolling, window, intrabar) for symbol, symbol_intervals in prepare_intervals.items()], workers)
     
     print(f"[SD] Successfully calculated all trades.")
 
 if __name__ == "__main__":
-    pd.options.mode.chained_assignment = None
-    main()
\ No newline at end of file
+    window = parallel.get_option("--window")
+    main(workers = parallel.get_workers(), rolling = parallel.get_flag("--rolling") or window is not None, window = window, intrabar = parallel.get_flag("--intrabar"))
@@ -1,108 +1,114 @@
-from glob import glob
 import pandas as pd
 import numpy as np
-from os.path import basename, exists
+import kline_store
+import trade_store
+import trade_kernel
+import panel
+import parallel
+import range_index
+import instrumentation
+import schemas
 
 def get_top_performers(df_kline): # Get top performers (best and worst 10%)
     # Get price change
     df_kline["change"] = df_kline["close"] / df_kline["open"] - 1
 
     # Build portfolio
-    df_kline = df_kline.sort_values(by = ["start_time"])
     portfolio_size = 10
-    df_kline = df_kline[df_kline.groupby("start_time")["start_time"].transform("size") >= portfolio_size] # Set minimum portfolio size
-    
+    df_panel = panel.build_panel(df_kline, ["change"])
+    change, valid = df_panel.get_valid("change", portfolio_size) # Set minimum portfolio size
+
     # Find percentile values
-    cutoffs = df_kline.groupby("start_time", group_keys = True)["change"].apply(lambda x: pd.Series({"worst": x.quantile(0.1), "best": x.quantile(0.9)})).reset_index() # Get cutoff values
-    cutoffs = cutoffs.pivot(index = "start_time", columns = "level_1", values = "change").reset_index() # Pivot Series to have "best" and "worst" columns with their respective values
-
-    # Get the worst 10% performers
-    df_worst_performers = pd.merge(df_kline, cutoffs, left_on = "start_time", right_on = "start_time")
-    df_worst_performers = df_worst_performers[df_worst_performers["change"] <= df_worst_performers["worst"]]
-    df_worst_performers["side"] = False
-
-    # Get the best 10% performers
-    df_best_performers = pd.merge(df_kline, cutoffs, left_on = "start_time", right_on = "start_time")
-    df_best_performers = df_best_performers[df_best_performers["change"] >= df_best_performers["best"]]
-    df_best_performers["side"] = True
-    
+    worst, best = panel.cross_sectional_quantile(change, [0.1, 0.9])[:, :, np.newaxis] # One sort for both quantiles
+
+    # Get the worst and the best 10% performers
+    df_worst_performers = df_panel.select(df_kline, valid & (change <= worst)).assign(side = False)
+    df_best_performers = df_panel.select(df_kline, valid & (change >= best)).assign(side = True)
+
     # Concat all to one dataframe
     df_top_performers = pd.concat([df_worst_performers, df_best_performers])
-    df_top_performers = df_top_performers.sort_values(by = ["start_time", "side"]).drop(columns = ["change", "best", "worst"])
+    df_top_performers = df_top_performers.sort_values(by = ["start_time", "side"], kind = "stable").drop(columns = ["change"]).reset_index(drop = True)
     return df_top_performers
 
-def isolate_cryptocurrencies(df_top_performers, symbol, file): # Isolate each cryptocurrency
-    # Merge the signal data with the raw data
-    df_top_performers = df_top_performers[["start_time", "side"]]
+def isolate_cryptocurrencies(df_top_performers, symbol): # Isolate each cryptocurrency
+    # Only candles with a signal can become trades, so the signals of the symbol replace the merge with its raw data
+    df_top_performers = df_top_performers[df_top_performers["symbol"] == symbol]
+    return df_top_performers[["start_time", "side"]].sort_values(by = ["start_time"], kind = "stable").reset_index(drop = True)
 
-    df_kline = pd.read_csv(f"01_raw/{symbol}_{basename(file)}", encoding = "utf-8")
-    df_kline = df_kline.drop(columns = ["volume", "turnover"])
-    df_kline = pd.merge(df_kline, df_top_performers, how = "left", left_on = "start_time", right_on = "start_time")
-
-    return df_kline
-
-def get_trades(df_kline, df_kline_holding, prepare_interval): # Get all trades
+def get_trades(df_kline, df_kline_holding, prepare_interval, range_index = None): # Get all trades
     # Merge formation period with holding period
-    df_kline = df_kline[["start_time", "side"]]
-
-    df_kline["earliest_holding_time"] = df_kline["start_time"] + (prepare_interval * 60 * 1000)
-    df_kline_holding["open_time_holding"] = df_kline_holding["start_time"]
-    df_kline_holding["close_time_holding"] = df_kline_holding["start_time"].shift(-1)
+    df_kline = df_kline[["start_time", "side"]].assign(earliest_holding_time = df_kline["start_time"] + (prepare_interval * 60 * 1000))
+    df_kline_holding = df_kline_holding.assign(open_time_holding = df_kline_holding["start_time"], close_time_holding = df_kline_holding["start_time"].shift(-1))
     df_kline_holding = df_kline_holding.dropna()
 
     df_kline = pd.merge_asof(df_kline, df_kline_holding, left_on = "earliest_holding_time", right_on = "start_time", direction = "forward")
     df_kline = df_kline.dropna()
+    return trade_kernel.get_trades(df_kline, range_index = range_index) # No funding fee
+
+def get_cross_section(interval, start_time = None, end_time = None): # Get all symbols of one interval as one dataframe (optionally only candles starting in [start_time, end_time)). Only the memory-mapped columns needed for the ranking are read.
+    symbols = [symbol for symbol, _ in kline_store.list_klines(interval)]
+    dtypes = schemas.get_dtypes(schemas.KLINES, ["start_time", "open", "close"])
+    columns = {column: [] for column in dtypes}
+    sizes = []
+    for symbol in symbols:
+        data = kline_store.read_columns(symbol, interval, list(dtypes))
+        first = 0 if start_time is None else np.searchsorted(data["start_time"], start_time)
+        last = data["start_time"].shape[0] if end_time is None else np.searchsorted(data["start_time"], end_time)
+        for column, dtype in dtypes.items():
+            columns[column].append(np.asarray(data[column][first:last], dtype = dtype))
+        instrumentation.count_read(*[values[-1] for values in columns.values()])
+        sizes.append(last - first)
+
+    df_kline = pd.DataFrame({column: np.concatenate(values) if len(values) > 0 else np.empty(0, dtype = dtypes[column]) for column, values in columns.items()}) # Create a portfolio of cryptocurrencies for one interval
+    df_kline["symbol"] = pd.Categorical.from_codes(np.repeat(np.arange(len(symbols)), sizes), symbols) # Symbols are sorted, so codes sort like names
+    return df_kline
 
-    try:
-        # Calculate max drawdown
-        conditions = [
-            df_kline["side"] == True
-            , df_kline["side"] == False
-        ]
-        choices = [
-            df_kline["low"] / df_kline["open"] - 1
-            , 1 - df_kline["high"] / df_kline["open"]
-        ]
-        df_kline["max_drawdown"] = np.select(conditions, choices, default = None)
-
-        # Calculate return
-        trading_fee = 0.0006
-
-        choices = [
-            (df_kline["close"] * (1 - trading_fee)) / (df_kline["open"] * (1 + trading_fee)) - 1
-            , 1 - (df_kline["close"] * (1 + trading_fee)) / (df_kline["open"] * (1 - trading_fee))
-        ]
-        df_kline["return"] = np.select(conditions, choices, default = None)
-
-        df_kline["max_drawdown"][df_kline["max_drawdown"] < -1] = -1 # Max drawdown can only be 100% loss.
-        df_kline["return"][df_kline["max_drawdown"] == -1] = -1 # In case of max drawdown of more than 100%, position would get liquidated, even if it eventually retraces.
-        df_kline["return"][df_kline["return"] < -1] = -1 # Position would get liquidated before having negative balance.
-    except: # No trade
-        return pd.DataFrame()
-    
-    df_kline = df_kline.copy().dropna()
-
-    # Calculate trade-relevant metrics and show each trade as one row
-    df_kline["entry_price"] = df_kline["open"]
-    df_kline["exit_price"] = df_kline["close"]
-    df_trades = df_kline[["open_time_holding", "entry_price", "close_time_holding", "exit_price", "max_drawdown", "return", "side"]]
-    df_trades = df_trades.rename(columns = {"open_time_holding": "entry_time", "close_time_holding": "exit_time"})
-    df_trades = df_trades.dropna().reset_index(drop = True)
-    return df_trades
-
-def calculate_trades(df_kline, file, intervals, prepare_interval):
-    df_top_performers = get_top_performers(df_kline) # Get trading signal
-    
-    for symbol, group in df_top_performers.groupby("symbol"):
-        print(symbol, file)
-        for holding_interval in intervals:
-            df_kline_holding = pd.read_csv(f"01_raw/{symbol}_{holding_interval}.csv", encoding = "utf-8")
-            df_kline_holding = df_kline_holding.drop(columns = ["volume", "turnover"])
-            df_kline = isolate_cryptocurrencies(group, symbol, file) # Isolate each cryptocurrency
-            df_trades = get_trades(df_kline, df_kline_holding, prepare_interval) # Get trades
-            df_trades.to_csv(f"02_strategy/ts/{symbol}_{basename(file)[:-4]}_{holding_interval}.csv", index_label = "trade")
-
-def main():
+def get_time_chunks(interval): # Get [start_time, end_time) ranges whose cross section fits into the memory budget. Rankings only compare candles of the same start_time, so chunks are independent.
+    symbols = kline_store.list_klines(interval)
+    rows = 0
+    first_time, last_time = None, None
+    for symbol, _ in symbols:
+        start_time = kline_store.read_columns(symbol, interval, ["start_time"])["start_time"]
+        if start_time.shape[0] > 0:
+            rows = rows + start_time.shape[0]
+            first_time = int(start_time[0]) if first_time is None else min(first_time, int(start_time[0]))
+            last_time = int(start_time[-1]) if last_time is None else max(last_time, int(start_time[-1]))
+
+    if rows == 0:
+        return [(None, None)]
+
+    # Long frame (with the change column) plus the dense times x symbols panel, which usually is the larger part
+    itemsize = np.dtype(schemas.get_precision()).itemsize
+    times = (last_time - first_time) // (interval * 60 * 1000) + 1
+    total_bytes = rows * (schemas.get_row_bytes(schemas.KLINES, ["start_time", "open", "close", "symbol"]) + itemsize) + times * len(symbols) * panel.get_cell_bytes(itemsize)
+    chunks = min(-(-total_bytes // schemas.get_memory_budget()), times)
+    if chunks <= 1:
+        return [(None, None)]
+    bounds = np.linspace(first_time, last_time + 1, chunks + 1).astype("int64") # Equal time spans
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+def get_signals(interval): # Get trading signal of one interval
+    with instrumentation.stage("ts_signals", interval):
+        frames = [get_top_performers(get_cross_section(interval, start_time, end_time))[["start_time", "symbol", "side"]] for start_time, end_time in get_time_chunks(interval)]
+        return schemas.concat_frames(frames, schemas.SIGNALS)
+
+def calculate_trades(symbol, signals, intervals, intrabar = False): # Get trades of one symbol for all pairs of prepare and holding intervals
+    with instrumentation.stage("ts", symbol):
+        cache = kline_store.KlineCache(columns = ["start_time", "open", "high", "low", "close"])
+        index = range_index.get_range_index(symbol) if intrabar else None # Drawdown from the 5 minute candles instead of the holding candle
+        frames = []
+
+        for prepare_interval, df_top_performers in signals.items():
+            df_kline = isolate_cryptocurrencies(df_top_performers, symbol) # Isolate each cryptocurrency
+            for holding_interval in intervals: # Every holding file of the symbol is loaded once
+                print(symbol, prepare_interval, holding_interval)
+                df_kline_holding = cache.get(symbol, holding_interval).copy()
+                df_trades = get_trades(df_kline, df_kline_holding, prepare_interval, index) # Get trades
+                frames.append((prepare_interval, holding_interval, None, df_trades))
+
+        trade_store.save_trades(frames, "ts", symbol) # Every partition belongs to exactly one symbol, so workers never write the same files
+
+def main(workers = 1, intrabar = False): # intrabar = True takes drawdown and liquidation from the 5 minute candles
     intervals = [
         5
         , 15
@@ -114,24 +120,21 @@ def main():
         , 720
         , 1440
     ]
-    
-    for interval in intervals:
-        files = glob(f"01_raw/*_{interval}.csv")
-        for file in files: # Read all files
-            df_kline = pd.read_csv(file, encoding = "utf-8") # Turn all files into Pandas Dataframes
-            df_kline = df_kline.drop(columns = ["volume", "turnover"])
-            df_kline["symbol"] = basename(file)[:basename(file).find(f"_{interval}.csv")]
-            path = f"02_strategy/ts/interval/{interval}.csv"
-            df_kline.to_csv(path, mode = "a", header = not exists(path), index = False) # Create a portfolio of cryptocurrencies for one interval
-    
-    files = glob(f"02_strategy/ts/interval/*.csv")
-    for file in files:
-        df_kline = pd.read_csv(file, encoding = "utf-8") # Turn all files into Pandas Dataframes
-        prepare_interval = int(basename(file)[:-4])
-        calculate_trades(df_kline, file, intervals, prepare_interval)
+
+    instrumentation.start_run("ts")
+    schemas.configure()
+    with instrumentation.stage("ts_signals"):
+        signals = dict(zip(intervals, parallel.run_tasks(get_signals, [(interval,) for interval in intervals], workers))) # Shard the cross-sectional step by interval
+
+    symbol_signals = {} # Shard trades by symbol. Workers only get the signals of their symbol.
+    for prepare_interval, df_top_performers in signals.items():
+        for symbol, group in df_top_performers.groupby("symbol", observed = True):
+            symbol_signals.setdefault(symbol, {})[prepare_interval] = group
+    tasks = [(symbol, symbol_signals[symbol], intervals, intrabar) for symbol in sorted(symbol_signals)]
+    with instrumentation.stage("ts"):
+        parallel.run_tasks(calculate_trades, tasks, workers)
         
     print(f"[TS] Successfully calculated all trades.")
 
 if __name__ == "__main__":
-    pd.options.mode.chained_assignment = None
-    main()
\ No newline at end of file
+    main(workers = parallel.get_workers(), intrabar = parallel.get_flag("--intrabar"))
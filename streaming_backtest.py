@@ -0,0 +1,141 @@
+from argparse import ArgumentParser
+from heapq import merge
+from itertools import groupby
+import pandas as pd
+import numpy as np
+import os
+import kline_store
+import trade_kernel
+import volatility
+import instrumentation
+from strategy_standard_deviation import update_trading_signal
+
+# Event-driven streaming backtest. The candles of all symbols are merged in timestamp order through generators and fed to the SD or TS
+# signal logic, and trades are emitted as soon as their holding candle closes. Memory is bounded by the lookback window
+# (volatility window, pending signals, one holding candle per symbol and one cross-section) and a fixed read buffer, not by the length of the history.
+# Trades are costed with trade_kernel.py, like in the batch scripts. The SD strategy needs a rolling standard deviation
+# (rolling = True of the batch script), as the full-sample standard deviation is not known while streaming.
+# > python streaming_backtest.py --strategy ts --prepare 360 --holding 120
+FUNDING_FEES = {
+    "sd": trade_kernel.FUNDING_FEE
+    , "ts": 0.0
+}
+
+class SymbolState: # Everything that is kept per symbol
+    def __init__(self, window):
+        self.estimator = volatility.RollingStandardDeviation(window)
+        self.pending = [] # Sides of signals waiting for their holding candle
+        self.holding = None # Current holding candle (start_time, open, high, low, close)
+        self.sides = [] # Sides of signals entering at the current holding candle
+
+def iterate_klines(symbol, interval, chunk_size = 1024): # Get candles (start_time, open, high, low, close) of a symbol, read from the memory-mapped store in chunks
+    data = kline_store.read_columns(symbol, interval, ["start_time", "open", "high", "low", "close"])
+    for start in range(0, data["start_time"].shape[0], chunk_size):
+        end = start + chunk_size
+        columns = [data[column][start:end] for column in ["start_time", "open", "high", "low", "close"]]
+        instrumentation.count_read(*columns)
+        yield from zip(*[column.tolist() for column in columns])
+
+def tag_klines(candles, delay, kind, symbol): # Get events (time, kind, symbol, candle). Formation candles (kind 0) are known at their close, holding candles (kind 1) at their open.
+    for candle in candles:
+        yield candle[0] + delay, kind, symbol, candle
+
+def iterate_events(symbols, prepare_interval, holding_interval, buffer_size = 65536): # Merge candles of all symbols in time order. Formation candles come before holding candles of the same time.
+    chunk_size = max(64, buffer_size // max(2 * len(symbols), 1)) # All streams are live at once, so together they hold about buffer_size candles as Python objects
+    streams = []
+    for symbol in symbols:
+        streams.append(tag_klines(iterate_klines(symbol, prepare_interval, chunk_size), prepare_interval * 60 * 1000, 0, symbol))
+        streams.append(tag_klines(iterate_klines(symbol, holding_interval, chunk_size), 0, 1, symbol))
+    return merge(*streams, key = lambda event: (event[0], event[1]))
+
+def close_holding(strategy, symbol, state, close_time): # Get trades of the current holding candle of a symbol once it closes
+    sides = state.sides
+    if strategy == "sd": # Only keep one position per holding candle. Do not trade at all if they cancel out.
+        longs = sum(sides)
+        shorts = len(sides) - longs
+        sides = [True] if longs > shorts else [False] if longs < shorts else []
+
+    if len(sides) == 0:
+        return
+    start_time, open, high, low, close = state.holding
+    max_drawdowns, trade_returns = trade_kernel.cost_trades(sides, [open], [high], [low], [close], [start_time], [close_time], funding_fee = FUNDING_FEES[strategy])
+    for side, max_drawdown, trade_return in zip(sides, max_drawdowns.tolist(), trade_returns.tolist()):
+        yield {
+            "symbol": symbol
+            , "entry_time": state.holding[0]
+            , "entry_price": state.holding[1]
+            , "exit_time": close_time
+            , "exit_price": state.holding[4]
+            , "max_drawdown": max_drawdown
+            , "return": trade_return
+            , "side": side
+        }
+
+def get_cross_section_signals(formation): # Get (symbol, side) of the best and worst 10% of one timestamp, like get_top_performers
+    portfolio_size = 10
+    if len(formation) < portfolio_size: # Set minimum portfolio size
+        return []
+    change = np.array([candle[4] / candle[1] - 1 for _, _, _, candle in formation])
+    valid = change[~np.isnan(change)]
+    if valid.shape[0] == 0:
+        return []
+    worst, best = np.quantile(valid, [0.1, 0.9])
+    return [(event[2], False) for event, value in zip(formation, change) if value <= worst] + [(event[2], True) for event, value in zip(formation, change) if value >= best]
+
+def run_backtest(strategy, prepare_interval, holding_interval, sigma = None, window = None, symbols = None): # Get trades (dicts) in the order their holding candles close
+    symbols = [symbol for symbol, _ in kline_store.list_klines(prepare_interval)] if symbols is None else symbols
+    states = {symbol: SymbolState(window) for symbol in symbols}
+
+    for _, events in groupby(iterate_events(symbols, prepare_interval, holding_interval), key = lambda event: event[0]):
+        events = list(events)
+        formation = [event for event in events if event[1] == 0]
+        holding = [event for event in events if event[1] == 1]
+
+        # Signals of candles that closed now
+        if strategy == "sd":
+            for _, _, symbol, candle in formation:
+                side = update_trading_signal(states[symbol].estimator, candle[4] / candle[1] - 1, sigma)
+                if side is not None:
+                    states[symbol].pending.append(side)
+        else:
+            for symbol, side in get_cross_section_signals(formation):
+                states[symbol].pending.append(side)
+
+        # A new holding candle closes the previous one and takes all pending signals (first holding candle at or after the earliest holding time)
+        for time, _, symbol, candle in holding:
+            state = states[symbol]
+            if state.holding is not None:
+                yield from close_holding(strategy, symbol, state, time)
+            state.holding = candle
+            state.sides = state.pending
+            state.pending = []
+
+def write_trades(trades, path, buffer_size = 65536): # Write trades to csv in buffered chunks
+    columns = ["symbol", "entry_time", "entry_price", "exit_time", "exit_price", "max_drawdown", "return", "side"]
+    instrumentation.write_csv(pd.DataFrame(columns = columns), path, index = False)
+    buffer = []
+    for trade in trades:
+        buffer.append(trade)
+        if len(buffer) == buffer_size:
+            instrumentation.write_csv(pd.DataFrame(buffer, columns = columns), path, mode = "a", header = False, index = False)
+            buffer = []
+    instrumentation.write_csv(pd.DataFrame(buffer, columns = columns), path, mode = "a", header = False, index = False)
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--strategy", choices = ["sd", "ts"], default = "ts")
+    parser.add_argument("--prepare", type = int, default = 360)
+    parser.add_argument("--holding", type = int, default = 120)
+    parser.add_argument("--sigma", type = float, default = 1.0)
+    parser.add_argument("--window", type = int, default = None, help = "rolling window of the SD strategy (default: all earlier candles)")
+    arguments = parser.parse_args()
+    if arguments.window is not None and arguments.window < 1:
+        parser.error("--window must be at least 1")
+
+    os.makedirs("02_strategy/stream", exist_ok = True)
+    path = f"02_strategy/stream/{arguments.strategy}_{arguments.prepare}_{arguments.holding}.csv"
+    write_trades(run_backtest(arguments.strategy, arguments.prepare, arguments.holding, arguments.sigma, arguments.window), path)
+    print(f"[STREAM] Successfully calculated all trades. ({path})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+import pandas as pd
+import numpy as np
+import unittest
+import io
+import os
+import kline_store
+import resample_engine
+import perf_suite
+import strategy_standard_deviation
+
+# Checks the vectorized netting of strategy_standard_deviation against the original row-wise filter_trades, which is kept here as reference.
+# > python -m unittest test_netting
+def filter_trades(df_group): # Filter trades of the same trading time. Remove positions if they cancel out (Long/Short)
+    longs = sum(df_group["side"])
+    shorts = len(df_group) - longs
+    if longs > shorts:
+        return df_group[df_group["side"] == True].iloc[:1]
+    elif longs < shorts:
+        return df_group[df_group["side"] == False].iloc[:1]
+    else:
+        return None
+
+def filter_trades_reference(df_kline): # Same as groupby("open_time_holding").apply(filter_trades), without the group key handling that differs between Pandas versions
+    frames = [filter_trades(df_group) for _, df_group in df_kline.groupby("open_time_holding", sort = True)]
+    frames = [df for df in frames if df is not None]
+    return pd.concat(frames).reset_index(drop = True) if len(frames) > 0 else df_kline.iloc[:0].reset_index(drop = True)
+
+class TestNetting(unittest.TestCase):
+    def assert_netting(self, df_kline):
+        pd.testing.assert_frame_equal(strategy_standard_deviation.filter_trades_vectorized(df_kline), filter_trades_reference(df_kline))
+
+    def test_ties_and_majorities(self):
+        df_kline = pd.DataFrame({
+            "start_time": np.arange(9, dtype = "int64")
+            , "side": [True, False, True, True, False, False, False, True, True]
+            , "open_time_holding": [1, 1, 2, 2, 2, 3, 3, 3, 4]
+        })
+        self.assert_netting(df_kline)
+        self.assert_netting(df_kline.iloc[:2]) # Only a tie, no trade is left
+
+    def test_generated_klines(self):
+        directory = os.getcwd()
+        with TemporaryDirectory() as temporary_directory:
+            os.chdir(temporary_directory)
+            try:
+                with redirect_stdout(io.StringIO()):
+                    perf_suite.generate_klines(4, 5000, seed = 1)
+                    for symbol, _ in kline_store.list_klines(5):
+                        resample_engine.update_resampled(symbol, 5, [15, 60], incremental = False)
+
+                for symbol, _ in kline_store.list_klines(5):
+                    for prepare_interval, holding_interval in [(5, 15), (5, 60), (15, 60)]:
+                        for sigma in [1.0, 2.0]:
+                            df_kline = strategy_standard_deviation.get_trading_signal(kline_store.load_klines(symbol, prepare_interval), sigma)
+                            df_kline = strategy_standard_deviation.align_holding(df_kline[["start_time", "side"]], kline_store.load_klines(symbol, holding_interval), prepare_interval)
+                            with self.subTest(symbol = symbol, prepare_interval = prepare_interval, holding_interval = holding_interval, sigma = sigma):
+                                self.assert_netting(df_kline)
+            finally:
+                os.chdir(directory)
+
+if __name__ == "__main__":
+    unittest.main()
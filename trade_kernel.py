@@ -0,0 +1,74 @@
+import pandas as pd
+import numpy as np
+
+# Shared trade costing of all strategies: entry at the open and exit at the close of the holding candle, trading fees, funding and liquidation.
+# Works on float64 arrays. side is 1.0 (long), 0.0 (short) or NaN (no trade), bool arrays work as well. Rows without a trade get NaN.
+# Every strategy keeps its own fee and funding: SD pays funding (FUNDING_FEE), TS does not (funding_fee = 0).
+TRADING_FEE = 0.0006
+FUNDING_FEE = 0.0001 # Base funding fee every 8 hours
+FUNDING_PERIOD = 1000 * 60 * 60 * 8
+COLUMNS = ["entry_time", "entry_price", "exit_time", "exit_price", "max_drawdown", "return", "side"]
+
+def cost_trades(side, open, high, low, close, open_time, close_time, trading_fee = TRADING_FEE, funding_fee = 0.0): # Get (max_drawdown, return) of every row
+    side = np.asarray(side, dtype = "float64")
+    open, high, low, close = (np.asarray(values, dtype = "float64") for values in (open, high, low, close))
+    funding = 1 - funding_fee * ((np.asarray(close_time, dtype = "float64") - np.asarray(open_time, dtype = "float64")) / FUNDING_PERIOD)
+    long = side == 1
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        max_drawdown = np.where(long, low / open - 1, 1 - high / open)
+        trade_return = np.where(
+            long
+            , ((close * (1 - trading_fee)) / (open * (1 + trading_fee)) - 1) * funding
+            , 1 - (close * (1 + trading_fee)) / (open * (1 - trading_fee)) * funding
+        )
+
+    max_drawdown = np.maximum(max_drawdown, -1) # Max drawdown can only be 100% loss.
+    trade_return = np.where(max_drawdown == -1, -1, trade_return) # In case of max drawdown of more than 100%, position would get liquidated, even if it eventually retraces.
+    trade_return = np.maximum(trade_return, -1) # Position would get liquidated before having negative balance.
+
+    no_trade = np.isnan(side)
+    max_drawdown[no_trade] = np.nan
+    trade_return[no_trade] = np.nan
+    return max_drawdown, trade_return
+
+def get_high_low(df_kline, range_index = None): # Get (high, low) of the holding candles. With a range index the worst excursion of the base candles between entry and exit counts as well (intrabar drawdown, see range_index.py).
+    high = df_kline["high"].to_numpy(dtype = "float64")
+    low = df_kline["low"].to_numpy(dtype = "float64")
+    if range_index is not None:
+        intrabar_high, intrabar_low = range_index.get_extremes(df_kline["open_time_holding"].to_numpy(dtype = "int64"), df_kline["close_time_holding"].to_numpy(dtype = "int64"))
+        high = np.fmax(high, intrabar_high)
+        low = np.fmin(low, intrabar_low)
+    return high, low
+
+def get_frame(df_kline, long, max_drawdown, trade_return): # Get trade frame of the costed rows (rows without a trade have a NaN return and are dropped)
+    traded = ~np.isnan(trade_return)
+    return pd.DataFrame({
+        "entry_time": df_kline["open_time_holding"].to_numpy(dtype = "int64")[traded]
+        , "entry_price": df_kline["open"].to_numpy(dtype = "float64")[traded]
+        , "exit_time": df_kline["close_time_holding"].to_numpy(dtype = "int64")[traded]
+        , "exit_price": df_kline["close"].to_numpy(dtype = "float64")[traded]
+        , "max_drawdown": max_drawdown[traded]
+        , "return": trade_return[traded]
+        , "side": long[traded]
+    }, columns = COLUMNS)
+
+def get_trades(df_kline, trading_fee = TRADING_FEE, funding_fee = 0.0, range_index = None): # Turn signals aligned with their holding candle (side, open, high, low, close, open_time_holding, close_time_holding) into trades, one row each
+    side = df_kline["side"].to_numpy(dtype = "float64", na_value = np.nan)
+    high, low = get_high_low(df_kline, range_index)
+    max_drawdown, trade_return = cost_trades(side, df_kline["open"], high, low, df_kline["close"], df_kline["open_time_holding"], df_kline["close_time_holding"], trading_fee, funding_fee)
+    return get_frame(df_kline, side == 1, max_drawdown, trade_return)
+
+def get_side_trades(df_kline, sides, trading_fee = TRADING_FEE, funding_fee = 0.0, range_index = None): # Get one trade frame per column of sides (holding candles x columns: 1 long, -1 short, 0 no trade). Every holding candle is costed once per direction, whatever the number of columns.
+    high, low = get_high_low(df_kline, range_index)
+    costs = {}
+    for long in [True, False]:
+        costs[long] = cost_trades(np.full(df_kline.shape[0], float(long)), df_kline["open"], high, low, df_kline["close"], df_kline["open_time_holding"], df_kline["close_time_holding"], trading_fee, funding_fee)
+
+    frames = []
+    for column in range(sides.shape[1]):
+        long = sides[:, column] > 0
+        max_drawdown = np.where(sides[:, column] != 0, np.where(long, costs[True][0], costs[False][0]), np.nan)
+        trade_return = np.where(sides[:, column] != 0, np.where(long, costs[True][1], costs[False][1]), np.nan)
+        frames.append(get_frame(df_kline, long, max_drawdown, trade_return))
+    return frames
@@ -0,0 +1,107 @@
+from functools import lru_cache
+from glob import glob
+import pandas as pd
+import numpy as np
+import columnar
+import schemas
+import instrumentation
+import os
+
+# Partitioned columnar trade dataset. Replaces one csv file per (symbol, prepare, holding[, sigma]) combination under 02_strategy/.
+# Every (strategy, symbol) pair is one partition (02_strategy/trades/{strategy}/{symbol}/, see columnar.py) and is written by exactly one worker.
+# Rows are grouped by prepare_interval, holding_interval and sigma (NaN for strategies without sigma) and ordered by entry_time inside every group.
+DIRECTORY = "02_strategy/trades"
+COLUMNS = {
+    "entry_time": np.dtype("int64")
+    , "prepare_interval": np.dtype("int64")
+    , "holding_interval": np.dtype("int64")
+    , "sigma": np.dtype("float64")
+    , "entry_price": np.dtype("float64")
+    , "exit_time": np.dtype("int64")
+    , "exit_price": np.dtype("float64")
+    , "max_drawdown": np.dtype("float64")
+    , "return": np.dtype("float64")
+    , "side": np.dtype("bool")
+}
+KEYS = ["prepare_interval", "holding_interval", "sigma"]
+
+def get_partition_path(strategy, symbol, directory = DIRECTORY): # Get directory of one strategy/symbol partition
+    return f"{directory}/{strategy}/{symbol}"
+
+def save_trades(frames, strategy, symbol, directory = DIRECTORY): # Replace the partition of a symbol with trades. frames is a list of (prepare_interval, holding_interval, sigma, df_trades).
+    partition = get_partition_path(strategy, symbol, directory)
+    columnar.truncate_partition(partition, COLUMNS, 0)
+
+    data = []
+    for prepare_interval, holding_interval, sigma, df_trades in frames:
+        if df_trades.shape[0] == 0:
+            continue
+        data.append(df_trades[["entry_time", "entry_price", "exit_time", "exit_price", "max_drawdown", "return", "side"]].astype(
+            {column: COLUMNS[column] for column in ["entry_time", "entry_price", "exit_time", "exit_price", "max_drawdown", "return", "side"]}
+        ).assign(prepare_interval = prepare_interval, holding_interval = holding_interval, sigma = np.nan if sigma is None else sigma))
+
+    df = pd.concat(data, ignore_index = True) if len(data) > 0 else pd.DataFrame({column: np.empty(0, dtype = dtype) for column, dtype in COLUMNS.items()})
+    return columnar.append_partition(partition, COLUMNS, df)
+
+def read_trades(strategy, symbol, columns = None, directory = DIRECTORY): # Get memory-mapped columns of a partition (zero-copy)
+    return columnar.read_partition(get_partition_path(strategy, symbol, directory), COLUMNS, columns)
+
+def load_trades(strategy, symbol, columns = None, prepare_interval = None, holding_interval = None, sigma = None, directory = DIRECTORY): # Get trades of a partition as Pandas Dataframe, optionally only of one group
+    columns = list(COLUMNS) if columns is None else columns
+    data = read_trades(strategy, symbol, None, directory)
+
+    rows = np.ones(data["entry_time"].shape[0], dtype = bool)
+    if prepare_interval is not None:
+        rows &= data["prepare_interval"] == prepare_interval
+    if holding_interval is not None:
+        rows &= data["holding_interval"] == holding_interval
+    if sigma is not None:
+        rows &= data["sigma"] == sigma
+
+    df = pd.DataFrame({column: data[column][rows] for column in columns}, columns = columns) # Only the selected rows are copied
+    instrumentation.count_read(*[df[column].to_numpy() for column in columns])
+    df["strategy"] = schemas.get_categorical(strategy, df.shape[0])
+    df["symbol"] = schemas.get_categorical(symbol, df.shape[0])
+    return schemas.apply_schema(df, schemas.TRADES)
+
+def get_groups(data): # Get rows [first, last) of every group in the columns of a partition as dict of (prepare_interval, holding_interval, sigma) -> (first, last), sigma None without sigma. Groups are stored as contiguous blocks, so one scan for changing keys finds all of them.
+    rows = data["prepare_interval"].shape[0]
+    if rows == 0:
+        return {}
+
+    changes = np.zeros(rows, dtype = bool)
+    changes[0] = True
+    for key in KEYS:
+        values = np.asarray(data[key])
+        changed = values[1:] != values[:-1]
+        if key == "sigma": # NaN (no sigma) never equals itself
+            changed &= ~(np.isnan(values[1:]) & np.isnan(values[:-1]))
+        changes[1:] |= changed
+
+    first = np.flatnonzero(changes)
+    last = np.append(first[1:], rows)
+    keys = zip(data["prepare_interval"][first].tolist(), data["holding_interval"][first].tolist(), data["sigma"][first].tolist())
+    return {(prepare_interval, holding_interval, None if np.isnan(sigma) else sigma): (start, end) for (prepare_interval, holding_interval, sigma), start, end in zip(keys, first.tolist(), last.tolist())}
+
+def read_groups(strategy, symbol, directory = DIRECTORY): # Get groups of a partition (see get_groups). They are found once per process until the partition is rewritten.
+    partition = get_partition_path(strategy, symbol, directory)
+    if not columnar.exists(partition, COLUMNS):
+        return {}
+    status = os.stat(columnar.get_column_path(partition, next(iter(COLUMNS)))) # Written last by every save
+    return get_partition_groups(partition, status.st_mtime_ns, status.st_size)
+
+@lru_cache(maxsize = 4096)
+def get_partition_groups(partition, modified, size): # Cached by partition and the modification time and size of its first column
+    return get_groups(columnar.read_partition(partition, COLUMNS, KEYS))
+
+def list_trades(strategy = None, directory = DIRECTORY): # Get all stored (strategy, symbol) pairs, sorted
+    partitions = []
+    for path in glob(f"{directory}/*/*/entry_time.bin"):
+        partition = os.path.dirname(path)
+        partition_strategy, symbol = os.path.basename(os.path.dirname(partition)), os.path.basename(partition)
+        if strategy is None or partition_strategy == strategy:
+            partitions.append((partition_strategy, symbol))
+    return sorted(partitions)
+
+def get_strategy_name(strategy, sigma): # Get strategy name used in the returns (for example "ts" or "sd/1.0")
+    return strategy if sigma is None or np.isnan(sigma) else f"{strategy}/{sigma}"
@@ -0,0 +1,76 @@
+from collections import deque
+from math import sqrt
+import numpy as np
+
+# Streaming standard deviation (ddof = 0) over the last "window" values (all values if window is None).
+# update() adds one value in constant time (Welford's one-pass algorithm). extend() adds many values at once with vectorized
+# window sums and leaves the same state behind, so a batch backtest and a candle-by-candle update share one estimator.
+class RollingStandardDeviation:
+    def __init__(self, window = None):
+        self.window = window
+        self.values = deque() # Values inside the window (only kept if there is a window)
+        self.count = 0 # Values inside the window
+        self.seen = 0 # All values ever added (not capped by the window)
+        self.mean = 0.0
+        self.m2 = 0.0 # Sum of squared differences from the mean
+
+    def get(self): # Get current standard deviation (NaN without values)
+        return sqrt(max(self.m2, 0.0) / self.count) if self.count > 0 else np.nan
+
+    def update(self, value): # Add one value and return the new standard deviation
+        self.seen = self.seen + 1
+        self.count = self.count + 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (value - self.mean)
+
+        if self.window is not None:
+            self.values.append(value)
+            if self.count > self.window: # Remove the oldest value
+                oldest = self.values.popleft()
+                self.count = self.count - 1
+                delta = oldest - self.mean
+                self.mean = self.mean - delta / self.count
+                self.m2 = self.m2 - delta * (oldest - self.mean)
+        return self.get()
+
+    def extend(self, values): # Add many values and return the standard deviation after each of them (same as calling update for every value)
+        values = np.asarray(values, dtype = "float64")
+        if values.shape[0] == 0:
+            return values
+        self.seen = self.seen + values.shape[0]
+
+        history = np.asarray(self.values, dtype = "float64") if self.window is not None else np.empty(0)
+        data = np.concatenate([history, values])
+        shift = data[0] # Sums of shifted values lose less precision
+        sum_1 = np.concatenate([[0.0], np.cumsum(data - shift)])
+        sum_2 = np.concatenate([[0.0], np.cumsum((data - shift) ** 2)])
+
+        end = np.arange(history.shape[0] + 1, data.shape[0] + 1)
+        if self.window is None: # Expanding: all earlier values count, including the ones added before this call
+            count = self.count + end
+            sum_1_window = sum_1[end] + self.count * (self.mean - shift)
+            sum_2_window = sum_2[end] + self.m2 + self.count * (self.mean - shift) ** 2
+        else:
+            start = np.maximum(end - self.window, 0)
+            count = end - start
+            sum_1_window = sum_1[end] - sum_1[start]
+            sum_2_window = sum_2[end] - sum_2[start]
+
+        variance = np.maximum(sum_2_window / count - (sum_1_window / count) ** 2, 0.0)
+
+        # Leave the same state behind as the update() calls would
+        if self.window is None:
+            self.mean = float(shift + sum_1_window[-1] / count[-1])
+            self.m2 = float(variance[-1] * count[-1])
+            self.count = int(count[-1])
+        else:
+            self.values = deque(data[-self.window:].tolist())
+            self.count = len(self.values)
+            self.mean = float(np.mean(data[-self.window:]))
+            self.m2 = float(np.sum((data[-self.window:] - self.mean) ** 2))
+        return np.sqrt(variance)
+
+def get_past_standard_deviation(values, window = None): # Get standard deviation of the values before every value (NaN for the first one), so a value never sees itself or the future
+    estimator = RollingStandardDeviation(window)
+    return np.concatenate([[np.nan], estimator.extend(values)[:-1]])
@@ -0,0 +1,121 @@
+from argparse import ArgumentParser
+import pandas as pd
+import numpy as np
+import os
+from benchmark_series import get_benchmark
+from range_index import SparseTable
+import trade_store
+import parallel
+import instrumentation
+
+# Walk-forward evaluation. Trades of every (prepare, holding, sigma) group are turned into prefix sums once (log growth, returns,
+# squared returns, liquidations) and range minimum indexes of max_drawdown and return (see range_index.py). Return, standard deviation (ddof = 0),
+# Sharpe ratio and max drawdown of any window of trades [start, end) are then O(1) lookups, so thousands of train/test windows
+# of a group are evaluated in one vectorized call instead of re-aggregating the trades of every window.
+# > python walk_forward.py --train 90 --test 30 --step 30 [--workers N]
+DAY = 24 * 60 * 60 * 1000
+
+class PrefixMetrics: # Metrics of any window of the trades of one group (trades ordered by entry_time)
+    def __init__(self, entry_time, exit_time, returns, max_drawdown):
+        self.entry_time = np.asarray(entry_time, dtype = "int64")
+        self.exit_time = np.asarray(exit_time, dtype = "int64")
+        returns = np.asarray(returns, dtype = "float64")
+
+        liquidated = returns <= -1 # Growth of a window is 0 once a trade lost everything, log growth cannot express that
+        with np.errstate(divide = "ignore"):
+            log_growth = np.where(liquidated, 0.0, np.log1p(np.where(liquidated, 0.0, returns)))
+        self.log_growth = np.concatenate([[0.0], np.cumsum(log_growth)])
+        self.liquidations = np.concatenate([[0], np.cumsum(liquidated)])
+        self.sum_1 = np.concatenate([[0.0], np.cumsum(returns)])
+        self.sum_2 = np.concatenate([[0.0], np.cumsum(returns ** 2)])
+        self.max_drawdown = SparseTable(max_drawdown, np.fmin)
+        self.lowest_return = SparseTable(returns, np.minimum) # Windows of equal returns have a standard deviation of exactly 0 (prefix sums leave rounding errors)
+        self.highest_return = SparseTable(returns, np.maximum)
+
+    def get_rows(self, start_time, end_time): # Get trades [first, last) entering in [start_time, end_time)
+        first = np.searchsorted(self.entry_time, np.asarray(start_time, dtype = "int64"), side = "left")
+        last = np.searchsorted(self.entry_time, np.asarray(end_time, dtype = "int64"), side = "left")
+        return first, np.maximum(first, last)
+
+    def evaluate(self, start_time, end_time, benchmark_file = "03_returns/benchmark/CRYPTOMARKETCAP_D.csv"): # Get metrics of every window as dict of arrays (NaN for windows without trades)
+        first, last = self.get_rows(start_time, end_time)
+        trades = last - first
+        filled = trades > 0
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            growth = np.where(self.liquidations[last] > self.liquidations[first], 0.0, np.exp(self.log_growth[last] - self.log_growth[first]))
+            mean = (self.sum_1[last] - self.sum_1[first]) / trades
+            standard_deviation = np.sqrt(np.maximum((self.sum_2[last] - self.sum_2[first]) / trades - mean ** 2, 0))
+            standard_deviation = np.where(self.highest_return.query(first, last) > self.lowest_return.query(first, last), standard_deviation, 0.0)
+            window_return = np.where(filled, growth - 1, np.nan)
+
+            first_entry_time = np.where(filled, self.entry_time[np.where(filled, first, 0)], 0) # Groups hold at least one trade
+            last_exit_time = np.where(filled, self.exit_time[np.where(filled, last - 1, 0)], 0)
+            benchmark_return = get_benchmark(benchmark_file).get_return(first_entry_time, last_exit_time)
+            sharpe = np.where(filled & (standard_deviation > 0), (window_return - benchmark_return) / standard_deviation, np.nan)
+
+        return {
+            "trades": trades
+            , "return": window_return
+            , "standard_deviation": np.where(filled, standard_deviation, np.nan)
+            , "total_crypto_sharpe": sharpe
+            , "max_drawdown": self.max_drawdown.query(first, last)
+        }
+
+def get_windows(first_time, last_time, train_days, test_days, step_days): # Get (train start, test start, test end) of all walk-forward windows inside [first_time, last_time]
+    train, test, step = int(train_days * DAY), int(test_days * DAY), int(step_days * DAY) # Days may be fractions
+    starts = np.arange(first_time, last_time - train - test + 1, step, dtype = "int64")
+    return starts, starts + train, starts + train + test
+
+def evaluate_partition(strategy, symbol, train_days, test_days, step_days): # Get walk-forward metrics of all groups of one partition (one row per group and window)
+    print(strategy, symbol)
+    data = trade_store.read_trades(strategy, symbol)
+
+    frames = []
+    for (prepare_interval, holding_interval, sigma), (first, last) in trade_store.get_groups(data).items():
+        columns = [data[column][first:last] for column in ["entry_time", "exit_time", "return", "max_drawdown"]]
+        instrumentation.count_read(*columns)
+        metrics = PrefixMetrics(*columns)
+        train_start, test_start, test_end = get_windows(int(metrics.entry_time[0]), int(metrics.exit_time[-1]), train_days, test_days, step_days)
+        if train_start.shape[0] == 0:
+            continue
+
+        df_windows = pd.DataFrame({"train_start": train_start, "test_start": test_start, "test_end": test_end})
+        for split, start_time, end_time in [("train", train_start, test_start), ("test", test_start, test_end)]:
+            for metric, values in metrics.evaluate(start_time, end_time).items():
+                df_windows[f"{split}_{metric}"] = values
+        df_windows.insert(0, "holding_interval", holding_interval)
+        df_windows.insert(0, "prepare_interval", prepare_interval)
+        df_windows.insert(0, "strategy", trade_store.get_strategy_name(strategy, sigma))
+        df_windows.insert(0, "symbol", symbol)
+        frames.append(df_windows)
+    return pd.concat(frames, ignore_index = True) if len(frames) > 0 else None
+
+def main(train_days = 90, test_days = 30, step_days = 30, workers = 1):
+    partitions = trade_store.list_trades()
+    frames = [df for df in parallel.run_tasks(evaluate_partition, [(strategy, symbol, train_days, test_days, step_days) for strategy, symbol in partitions], workers) if df is not None]
+    if len(frames) == 0:
+        print("[!] No trades.")
+        return
+    df_windows = pd.concat(frames, ignore_index = True)
+
+    os.makedirs("03_returns", exist_ok = True)
+    instrumentation.write_csv(df_windows, "03_returns/walk_forward.csv", index = False)
+
+    # Stability of every configuration: how often the test window is profitable and its mean return and Sharpe ratio
+    df_windows["test_profitable"] = df_windows["test_return"] > 0
+    df_stability = df_windows.groupby(["strategy", "prepare_interval", "holding_interval"]).agg(
+        windows = ("test_return", "count")
+        , test_profitable = ("test_profitable", "mean")
+        , test_return = ("test_return", "mean")
+        , test_total_crypto_sharpe = ("test_total_crypto_sharpe", "mean")
+    )
+    instrumentation.write_csv(df_stability, "03_returns/walk_forward_stability.csv")
+    print(df_stability.sort_values("test_total_crypto_sharpe"))
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--train", type = float, default = 90, help = "train window in days")
+    parser.add_argument("--test", type = float, default = 30, help = "test window in days")
+    parser.add_argument("--step", type = float, default = 30, help = "days between two windows")
+    arguments = parser.parse_known_args()[0]
+    main(arguments.train, arguments.test, arguments.step, parallel.get_workers())